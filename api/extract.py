@@ -1,19 +1,140 @@
+import bisect
+import codecs
+import copy
+import functools
+import http.client
+import http.cookiejar
 import json
+import math
 import os
 import re
+import ssl
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
 from http.server import BaseHTTPRequestHandler
-from urllib.parse import urlparse, urlunparse
-from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urljoin, urlparse, urlunparse
 import html
-import tempfile
 import time
 
-from yt_dlp import YoutubeDL
-
 API_TOKEN = os.environ.get("API_TOKEN", "")
 SUPPORTED_HOSTS = ("instagram.com", "facebook.com", "fb.watch")
-INSTAGRAM_SESSIONID = os.environ.get("INSTAGRAM_SESSIONID", "").strip()
-INSTAGRAM_COOKIES = os.environ.get("INSTAGRAM_COOKIES", "").strip()
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "512"))
+RESULT_CACHE_DEFAULT_TTL = int(os.environ.get("RESULT_CACHE_DEFAULT_TTL", "300"))
+RESULT_CACHE_MAX_TTL = int(os.environ.get("RESULT_CACHE_MAX_TTL", "21600"))
+# Stop serving a signed CDN URL this many seconds before it lapses.
+CDN_EXPIRY_MARGIN = 120
+FAILURE_CACHE_SIZE = int(os.environ.get("FAILURE_CACHE_SIZE", "512"))
+# How long a classified failure is replayed before upstream is asked again.
+FAILURE_CACHE_TTLS = {
+    "rate_limited": int(os.environ.get("FAILURE_TTL_RATE_LIMITED", "30")),
+    "login_required": int(os.environ.get("FAILURE_TTL_LOGIN_REQUIRED", "300")),
+    "not_found": int(os.environ.get("FAILURE_TTL_NOT_FOUND", "900")),
+}
+# Only a real 429 slows the bucket. yt-dlp's "rate-limit reached or login
+# required" is also what every private reel returns, so it does not count.
+RATE_LIMIT_PATTERNS = ("http error 429", "too many requests")
+FAILURE_PATTERNS = (
+    ("rate_limited", ("http error 429", "too many requests", "rate-limit", "rate limit")),
+    ("login_required", ("login required", "log in", "private", "checkpoint")),
+    (
+        "not_found",
+        (
+            "http error 404",
+            "http error 410",
+            "not found",
+            "does not exist",
+            "has been removed",
+            "isn't available",
+        ),
+    ),
+)
+# Whole-request budget; keep it under the function's maxDuration in vercel.json.
+REQUEST_BUDGET = float(os.environ.get("REQUEST_BUDGET", "50"))
+HTML_TIMEOUT = 25.0
+YTDLP_SOCKET_TIMEOUT = 20.0
+# Don't start an attempt that has less than this much budget left.
+MIN_ATTEMPT_BUDGET = 1.0
+# Token bucket shared by every yt-dlp and HTML request to Instagram/Facebook.
+UPSTREAM_RATE = float(os.environ.get("UPSTREAM_RATE", "5"))
+UPSTREAM_BURST = float(os.environ.get("UPSTREAM_BURST", "10"))
+# Longest an attempt queues for a token before failing fast.
+UPSTREAM_MAX_WAIT = float(os.environ.get("UPSTREAM_MAX_WAIT", "5"))
+# A 429 halves the rate (down to this floor) and pauses upstream calls; the
+# pause doubles on consecutive 429s up to UPSTREAM_MAX_BACKOFF.
+UPSTREAM_MIN_RATE = 0.5
+UPSTREAM_MAX_BACKOFF = 60.0
+THROTTLED_MESSAGE = "upstream request budget exhausted"
+# Shared by THROTTLED_MESSAGE and DeadlineExceeded: the attempt was never sent.
+ATTEMPT_NOT_SENT = "request budget exhausted"
+# A rate-limited session sits out this long, doubling on repeat offences.
+SESSION_QUARANTINE = float(os.environ.get("SESSION_QUARANTINE", "120"))
+SESSION_MAX_QUARANTINE = 3600.0
+# Login walls can be the reel's fault (private account), so a session is only
+# quarantined after this many in a row.
+SESSION_LOGIN_STRIKES = 3
+# Opt-in: try the cheap public-HTML path for Instagram before loading yt-dlp.
+HTML_FIRST = os.environ.get("HTML_FIRST", "").strip().lower() in ("1", "true", "yes")
+# Opt-in: register only the Instagram/Facebook extractors instead of yt-dlp's
+# full registry of ~1800, which is cheaper to build and to match URLs against.
+YTDLP_TRIMMED_EXTRACTORS = os.environ.get(
+    "YTDLP_TRIMMED_EXTRACTORS", ""
+).strip().lower() in ("1", "true", "yes")
+# Idle YoutubeDL instances kept per distinct option set.
+YTDLP_POOL_SIZE = int(os.environ.get("YTDLP_POOL_SIZE", "4"))
+HTTP_POOL_MAX_PER_HOST = int(os.environ.get("HTTP_POOL_MAX_PER_HOST", "4"))
+# Servers drop idle keep-alive sockets; don't reuse ones older than this.
+HTTP_POOL_IDLE_TIMEOUT = 30.0
+MAX_REDIRECTS = 5
+HTML_CHUNK_SIZE = 16384
+# Tail kept between chunks so a match split across a boundary is still seen.
+HTML_SCAN_OVERLAP = 8192
+# After an early stop, read at most this much more so the keep-alive
+# connection can go back to the pool; a longer remainder closes it instead.
+HTML_DRAIN_LIMIT = 65536
+# Media alternatives are listed in preference order.
+HTML_MEDIA_GROUPS = ("og_video", "video_url", "playback_url")
+HTML_SCAN_RE = re.compile(
+    r'<meta[^>]+property=["\']og:video(?::secure_url)?["\'][^>]+content=["\'](?P<og_video>[^"\']+)["\']'
+    r'|"video_url":"(?P<video_url>https:[^"]+)"'
+    r'|"playback_url":"(?P<playback_url>https:[^"]+)"'
+    r'|<meta[^>]+property=["\']og:title["\'][^>]+content=["\'](?P<title>[^"\']+)["\']'
+    r'|(?P<login_wall>id=["\']login_?form["\'])',
+    re.IGNORECASE,
+)
+# Error recorded when the page is the login form instead of the reel.
+LOGIN_WALL_MESSAGE = "login required: page shows the login form"
+# Strategy stats: EWMA weight of the newest sample, and how long a (strategy,
+# kind) pair may go untried before its stats fall back to the prior.
+STRATEGY_EWMA_ALPHA = 0.2
+STRATEGY_STALE_SECONDS = 600.0
+STRATEGY_PRIOR_SUCCESS = 0.5
+STRATEGY_PRIOR_LATENCY = 3.0
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0
+)
+BATCH_MAX_URLS = int(os.environ.get("BATCH_MAX_URLS", "50"))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "4"))
+# Launch the next strategy this long after the previous one unless it fails sooner.
+HEDGE_DELAY = float(os.environ.get("HEDGE_DELAY", "1.5"))
+RACE_WORKERS = int(os.environ.get("RACE_WORKERS", "4"))
+# all_media mode: entries returned per post, and how many are resolved at once.
+CAROUSEL_MAX_ITEMS = int(os.environ.get("CAROUSEL_MAX_ITEMS", "20"))
+CAROUSEL_WORKERS = int(os.environ.get("CAROUSEL_WORKERS", "4"))
+# Instagram's video_versions formats carry no size or bitrate; their size is
+# estimated from resolution and duration at a typical H.264 reel bitrate.
+VARIANT_BITS_PER_PIXEL = 0.1
+VARIANT_DEFAULT_FPS = 30
+SHORTCODE_RE = re.compile(r"/(reel|reels|p)/([A-Za-z0-9_-]+)")
+# /reel/<id>, /<page>/videos/<id>/ and /<page>/videos/<slug>/<id>/
+FACEBOOK_VIDEO_RE = re.compile(r"/(?:reel|videos)/(?:[^/]+/)*?(\d+)(?:/|$)")
+# fb.watch and /share/ links only redirect to the real post. Where they point
+# is cached per instance so the redirect chain is followed once.
+SHORT_LINK_CACHE_SIZE = int(os.environ.get("SHORT_LINK_CACHE_SIZE", "1024"))
+SHORT_LINK_TTL = int(os.environ.get("SHORT_LINK_TTL", "86400"))
+SHORT_LINK_TIMEOUT = 10.0
 
 
 def sanitize_filename(title: str, ext: str) -> str:
@@ -24,19 +145,35 @@ def sanitize_filename(title: str, ext: str) -> str:
 
 
 def build_cookie_header() -> str:
-    if INSTAGRAM_COOKIES:
-        return INSTAGRAM_COOKIES
-    if INSTAGRAM_SESSIONID:
-        return f"sessionid={INSTAGRAM_SESSIONID}"
+    # Read on every call so a changed environment is picked up without a restart.
+    cookies = os.environ.get("INSTAGRAM_COOKIES", "").strip()
+    if cookies:
+        return cookies
+    sessionid = os.environ.get("INSTAGRAM_SESSIONID", "").strip()
+    if sessionid:
+        return f"sessionid={sessionid}"
     return ""
 
 
-def build_cookiefile() -> str:
-    cookie_header = build_cookie_header()
-    if not cookie_header:
-        return ""
+def parse_sessions(value: str) -> list[str]:
+    # INSTAGRAM_SESSIONS: one cookie header (or bare sessionid) per line or "|".
+    headers = []
+    for entry in re.split(r"[\n|]", value):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if "=" not in entry:
+            entry = f"sessionid={entry}"
+        if entry not in headers:
+            headers.append(entry)
+    return headers
 
-    entries: list[tuple[str, str]] = []
+
+@functools.lru_cache(maxsize=64)
+def build_cookies(cookie_header: str) -> tuple:
+    # Parsed once per distinct header value and loaded straight into each
+    # pooled YoutubeDL's cookie jar, so no cookie file is written per request.
+    cookies = []
     for chunk in cookie_header.split(";"):
         part = chunk.strip()
         if "=" not in part:
@@ -46,26 +183,27 @@ def build_cookiefile() -> str:
         value = value.strip()
         if not name or not value:
             continue
-        entries.append((name, value))
-
-    if not entries:
-        return ""
-
-    expires = str(int(time.time()) + 30 * 24 * 60 * 60)
-    lines = ["# Netscape HTTP Cookie File"]
-    for name, value in entries:
-        lines.append(
-            "\t".join(
-                [".instagram.com", "TRUE", "/", "TRUE", expires, name, value]
+        cookies.append(
+            http.cookiejar.Cookie(
+                version=0,
+                name=name,
+                value=value,
+                port=None,
+                port_specified=False,
+                domain=".instagram.com",
+                domain_specified=True,
+                domain_initial_dot=True,
+                path="/",
+                path_specified=True,
+                secure=True,
+                expires=None,
+                discard=False,
+                comment=None,
+                comment_url=None,
+                rest={},
             )
         )
-
-    handle = tempfile.NamedTemporaryFile(
-        mode="w", prefix="ig_cookie_", suffix=".txt", delete=False
-    )
-    with handle:
-        handle.write("\n".join(lines) + "\n")
-    return handle.name
+    return tuple(cookies)
 
 
 def decode_escaped_url(value: str) -> str:
@@ -84,33 +222,798 @@ def is_supported_url(url: str) -> bool:
     return any(h in host for h in SUPPORTED_HOSTS)
 
 
-def build_candidate_urls(url: str) -> list[str]:
-    candidates: list[str] = []
+def is_short_link(url: str) -> bool:
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if host == "fb.watch" or host.endswith(".fb.watch"):
+        return True
+    return (
+        ("facebook.com" in host or "instagram.com" in host)
+        and (parsed.path or "").startswith("/share/")
+    )
+
+
+def media_key(url: str) -> str | None:
+    # "instagram:<shortcode>" / "facebook:<video id>", or None when the URL
+    # does not name the media itself (short/share links included).
+    if is_short_link(url):
+        return None
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+
+    # Every /reel/, /reels/ and /p/ variant of a shortcode is the same media.
+    if "instagram.com" in host:
+        match = SHORTCODE_RE.search(parsed.path or "")
+        if match:
+            return f"instagram:{match.group(2)}"
+
+    # watch/?v=, video.php?v=, /reel/<id> and /videos/<id> all name one video.
+    if "facebook.com" in host:
+        video_id = (parse_qs(parsed.query).get("v") or [""])[0]
+        if video_id.isdigit():
+            return f"facebook:{video_id}"
+        match = FACEBOOK_VIDEO_RE.search(parsed.path or "")
+        if match:
+            return f"facebook:{match.group(1)}"
+    return None
+
 
-    def add(value: str) -> None:
+def build_candidates(url: str) -> list[tuple[str, str]]:
+    # (kind, url) pairs; the kind is what strategy stats are tracked against.
+    candidates: list[tuple[str, str]] = []
+
+    def add(kind: str, value: str) -> None:
         value = value.strip()
-        if value and value not in candidates:
-            candidates.append(value)
+        if value and all(value != existing for _, existing in candidates):
+            candidates.append((kind, value))
 
-    add(url)
+    add("raw", url)
     parsed = urlparse(url)
     host = (parsed.hostname or "").lower()
 
     # Retry once without tracking query/hash from share links.
     if parsed.scheme and parsed.netloc:
-        add(urlunparse((parsed.scheme, parsed.netloc, parsed.path, "", "", "")))
+        stripped = urlunparse((parsed.scheme, parsed.netloc, parsed.path, "", "", ""))
+        add("stripped", stripped)
 
     # Canonicalize Instagram reel URLs to reduce extractor failures.
-    if "instagram.com" in host:
-        match = re.search(r"/(reel|reels|p)/([A-Za-z0-9_-]+)", parsed.path or "")
+    if "instagram.com" in host and not is_short_link(url):
+        match = SHORTCODE_RE.search(parsed.path or "")
         if match:
-            add(f"https://www.instagram.com/{match.group(1)}/{match.group(2)}/")
-            add(f"https://www.instagram.com/{match.group(1)}/{match.group(2)}/embed/captioned/")
+            base = f"https://www.instagram.com/{match.group(1)}/{match.group(2)}/"
+            add("canonical", base)
+            add("embed", base + "embed/captioned/")
+
+    key = media_key(url)
+    if key and key.startswith("facebook:"):
+        add("canonical", f"https://www.facebook.com/watch/?v={key.split(':', 1)[1]}")
 
     return candidates
 
 
-def fetch_html(url: str, cookie_header: str = "") -> str:
+def canonical_key(url: str) -> str:
+    key = media_key(url)
+    if key:
+        return key
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    return urlunparse(("https", host, parsed.path.rstrip("/"), "", parsed.query, ""))
+
+
+def cache_ttl_for(media_url: str) -> int:
+    # Instagram/Facebook CDN URLs carry their signed expiry as hex epoch in `oe`.
+    values = parse_qs(urlparse(media_url).query).get("oe")
+    if not values:
+        return RESULT_CACHE_DEFAULT_TTL
+    try:
+        expires = int(values[0], 16)
+    except ValueError:
+        return RESULT_CACHE_DEFAULT_TTL
+    ttl = expires - int(time.time()) - CDN_EXPIRY_MARGIN
+    return max(0, min(ttl, RESULT_CACHE_MAX_TTL))
+
+
+def failure_reasons(message: str) -> list[str]:
+    message = message.lower()
+    return [
+        reason
+        for reason, needles in FAILURE_PATTERNS
+        if any(needle in message for needle in needles)
+    ]
+
+
+def classify_error(message: str) -> str | None:
+    # yt-dlp's "rate-limit reached or login required" matches two types; the
+    # shortest TTL wins so a transient limit never pins a reel for long.
+    return min(failure_reasons(message), key=FAILURE_CACHE_TTLS.get, default=None)
+
+
+def classify_failure(errors: list[str]) -> str | None:
+    # Each attempt is judged on its own. Attempts shed locally or cut off by
+    # the deadline never reached upstream and say nothing about the reel; of
+    # the rest, one unclassified error (timeout, network, empty page) means the
+    # failure may be transient and is not cached at all.
+    sent = [error for error in errors if ATTEMPT_NOT_SENT not in error]
+    reasons = [classify_error(error) for error in sent]
+    if not reasons or None in reasons:
+        return None
+    # An attempt that saw the login wall settles yt-dlp's ambiguous message;
+    # only a real 429 keeps it a rate limit.
+    if "login_required" in reasons and not any(is_rate_limited(e) for e in sent):
+        reasons = [
+            "login_required" if "login_required" in failure_reasons(error) else reason
+            for error, reason in zip(sent, reasons)
+        ]
+    return min(reasons, key=FAILURE_CACHE_TTLS.get)
+
+
+def is_rate_limited(message: str) -> bool:
+    message = message.lower()
+    return any(needle in message for needle in RATE_LIMIT_PATTERNS)
+
+
+def session_failure(errors: list[str]) -> str:
+    # Session health needs an unambiguous signal. Only a real 429 counts as a
+    # rate limit (quarantine at once). yt-dlp's "rate-limit reached or login
+    # required", which every private reel also returns, is a login wall and
+    # needs SESSION_LOGIN_STRIKES in a row.
+    sent = [error for error in errors if ATTEMPT_NOT_SENT not in error]
+    if any(is_rate_limited(error) for error in sent):
+        return "rate_limited"
+    if any(classify_error(error) in ("login_required", "rate_limited") for error in sent):
+        return "login_required"
+    return "failed"
+
+
+class ResultCache:
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: dict, ttl: int) -> None:
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_SIZE)
+FAILURE_CACHE = ResultCache(FAILURE_CACHE_SIZE)
+SHORT_LINK_CACHE = ResultCache(SHORT_LINK_CACHE_SIZE)
+
+
+class Metrics:
+    # Minimal Prometheus-style registry. Observations are a dict lookup, a
+    # bisect and a few additions under one lock, cheap next to any network call.
+    def __init__(self) -> None:
+        self._counters: dict[tuple, float] = {}
+        self._histograms: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                # Per-bucket counts, then +Inf, sum and count.
+                series = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+            series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _labels(pairs, extra: str = "") -> str:
+        parts = [f'{k}="{v}"' for k, v in pairs]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self, gauges: dict[str, float]) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(series) for key, series in self._histograms.items()}
+
+        lines: list[str] = []
+        typed: set[str] = set()
+        for (name, pairs), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._labels(pairs)} {value:g}")
+        for (name, pairs), series in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{self._labels(pairs, le)} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(pairs)} {series[-2]:.6f}")
+            lines.append(f"{name}_count{self._labels(pairs)} {series[-1]}")
+        for name, value in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget: float) -> None:
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() < MIN_ATTEMPT_BUDGET
+
+    def timeout(self, cap: float) -> float:
+        if self.expired():
+            raise DeadlineExceeded("request budget exhausted")
+        return min(cap, self.remaining())
+
+
+class UpstreamThrottled(Exception):
+    pass
+
+
+class RateGovernor:
+    # Token bucket with AIMD feedback: callers reserve a token (possibly one
+    # that refills in the future, i.e. they queue), 429s cut the rate and add a
+    # growing pause, and successes restore the rate step by step.
+    def __init__(self, rate: float, burst: float, max_wait: float) -> None:
+        self.base_rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.granted = 0
+        self.shed = 0
+        self.throttled = 0
+        self._state = {
+            "tokens": burst,
+            "updated": time.time(),
+            "rate": rate,
+            "backoff": 0.0,
+            "blocked_until": 0.0,
+        }
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            yield self._state
+
+    def reserve(self, max_wait: float) -> float | None:
+        with self._transaction() as state:
+            now = time.time()
+            elapsed = max(0.0, now - state["updated"])
+            state["tokens"] = min(self.burst, state["tokens"] + elapsed * state["rate"])
+            state["updated"] = now
+            wait = max(
+                state["blocked_until"] - now,
+                (1 - state["tokens"]) / state["rate"],
+                0.0,
+            )
+            if wait > max_wait:
+                self.shed += 1
+                return None
+            state["tokens"] -= 1
+            self.granted += 1
+            return wait
+
+    def wait_budget(self, deadline: Deadline | None) -> float:
+        if deadline is None:
+            return self.max_wait
+        return min(self.max_wait, deadline.remaining() - MIN_ATTEMPT_BUDGET)
+
+    def acquire(self, deadline: Deadline | None = None) -> None:
+        wait = self.reserve(self.wait_budget(deadline))
+        if wait is None:
+            raise UpstreamThrottled(THROTTLED_MESSAGE)
+        if wait:
+            time.sleep(wait)
+
+    def penalize(self) -> None:
+        with self._transaction() as state:
+            now = time.time()
+            # Requests already in flight report the same episode; count it once.
+            if state["blocked_until"] > now:
+                return
+            state["rate"] = max(UPSTREAM_MIN_RATE, state["rate"] / 2)
+            state["backoff"] = min(UPSTREAM_MAX_BACKOFF, max(1.0, state["backoff"] * 2))
+            state["blocked_until"] = now + state["backoff"]
+            self.throttled += 1
+
+    def reward(self) -> None:
+        with self._transaction() as state:
+            state["rate"] = min(self.base_rate, state["rate"] + self.base_rate / 10)
+            state["backoff"] = 0.0
+
+    def feedback(self, exc: Exception | None) -> None:
+        if exc is None:
+            self.reward()
+        elif is_rate_limited(str(exc)):
+            self.penalize()
+
+    @contextmanager
+    def slot(self, deadline: Deadline | None = None):
+        self.acquire(deadline)
+        try:
+            yield
+        except Exception as exc:
+            self.feedback(exc)
+            raise
+        self.feedback(None)
+
+    def retry_after(self) -> int:
+        with self._transaction() as state:
+            paused = state["blocked_until"] - time.time()
+            queued = (1 - state["tokens"]) / state["rate"]
+        return max(1, math.ceil(max(paused, queued - self.max_wait)))
+
+    def stats(self) -> dict:
+        with self._transaction() as state:
+            rate = state["rate"]
+            paused = max(0.0, state["blocked_until"] - time.time())
+        return {
+            "rate": round(rate, 3),
+            "paused_seconds": round(paused, 3),
+            "granted": self.granted,
+            "shed": self.shed,
+            "throttled": self.throttled,
+        }
+
+
+UPSTREAM = RateGovernor(UPSTREAM_RATE, UPSTREAM_BURST, UPSTREAM_MAX_WAIT)
+
+
+class Session:
+    def __init__(self, label: str, cookie_header: str, governor: RateGovernor) -> None:
+        self.label = label
+        self.cookie_header = cookie_header
+        self.cookies = build_cookies(cookie_header)
+        self.governor = governor
+        self.requests = 0
+        self.failures = 0
+        self.strikes = 0
+        self.quarantines = 0
+        self.last_used = 0.0
+        self.last_throttled = 0.0
+        self.quarantined_until = 0.0
+
+
+class SessionPool:
+    # Spreads requests over the configured Instagram sessions. Each session has
+    # its own token bucket, so throughput grows with the number of accounts.
+    # Selection prefers the session throttled longest ago (never-throttled ones
+    # first), then the least recently used, i.e. round-robin among healthy ones.
+    def __init__(self) -> None:
+        self._source: tuple | None = None
+        self._sessions: list[Session] = []
+        self._anonymous = Session("anonymous", "", UPSTREAM)
+        self._lock = threading.Lock()
+
+    def _load(self) -> list[Session]:
+        # Re-checked per request, like build_cookie_header(); sessions that stay
+        # configured keep their health state and token bucket.
+        source = (os.environ.get("INSTAGRAM_SESSIONS", ""), build_cookie_header())
+        if source != self._source:
+            headers = parse_sessions(source[0]) or ([source[1]] if source[1] else [])
+            known = {session.cookie_header: session for session in self._sessions}
+            self._sessions = [
+                known.get(header)
+                or Session(
+                    f"s{index}",
+                    header,
+                    RateGovernor(UPSTREAM_RATE, UPSTREAM_BURST, UPSTREAM_MAX_WAIT),
+                )
+                for index, header in enumerate(headers)
+            ]
+            self._source = source
+        return self._sessions
+
+    def acquire(self) -> Session:
+        with self._lock:
+            sessions = self._load()
+            if not sessions:
+                return self._anonymous
+            now = time.monotonic()
+            healthy = [s for s in sessions if s.quarantined_until <= now]
+            if healthy:
+                chosen = min(healthy, key=lambda s: (s.last_throttled, s.last_used))
+            else:
+                chosen = min(sessions, key=lambda s: s.quarantined_until)
+            chosen.last_used = now
+            chosen.requests += 1
+            return chosen
+
+    def report(self, session: Session, reason: str | None) -> None:
+        if session is self._anonymous:
+            return
+        with self._lock:
+            if reason not in ("rate_limited", "login_required"):
+                session.strikes = 0
+                if reason is None:
+                    session.quarantines = 0
+                return
+            now = time.monotonic()
+            session.failures += 1
+            session.strikes += 1
+            session.last_throttled = now
+            limit = 1 if reason == "rate_limited" else SESSION_LOGIN_STRIKES
+            if session.strikes < limit:
+                return
+            session.strikes = 0
+            session.quarantines += 1
+            session.quarantined_until = now + min(
+                SESSION_MAX_QUARANTINE,
+                SESSION_QUARANTINE * 2 ** (session.quarantines - 1),
+            )
+        METRICS.inc("extract_session_quarantines_total", session=session.label, reason=reason)
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            sessions = list(self._sessions)
+            now = time.monotonic()
+        return [
+            {
+                "session": session.label,
+                "requests": session.requests,
+                "failures": session.failures,
+                "quarantined_for": round(max(0.0, session.quarantined_until - now), 1),
+                "upstream": session.governor.stats(),
+            }
+            for session in sessions
+        ]
+
+
+SESSIONS = SessionPool()
+
+
+def pooled_timeout(seconds: float) -> float:
+    # Bucket socket timeouts so deadline-derived values still share pool entries.
+    if seconds >= 5:
+        return float(math.floor(seconds / 5) * 5)
+    return float(max(1, math.floor(seconds)))
+
+
+def build_ydl_opts(socket_timeout: float, noplaylist: bool = True) -> dict:
+    return {
+        "quiet": True,
+        "no_warnings": True,
+        "skip_download": True,
+        "nocheckcertificate": False,
+        "noplaylist": noplaylist,
+        "socket_timeout": pooled_timeout(socket_timeout),
+        "http_headers": {
+            "User-Agent": (
+                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                "AppleWebKit/537.36 (KHTML, like Gecko) "
+                "Chrome/124.0.0.0 Safari/537.36"
+            ),
+            "Referer": "https://www.instagram.com/",
+        },
+    }
+
+
+_ytdlp_lock = threading.Lock()
+_YoutubeDL = None
+_extractors: tuple = ()
+# Time spent on the lazy yt-dlp import, reported on GET /api/extract.
+IMPORT_TIMINGS: dict[str, float] = {}
+
+
+def import_trimmed_extractors() -> tuple:
+    # Registry order. GenericIE comes last, as in the full registry: fb.watch
+    # and /share/ links only redirect to a URL the Facebook extractors handle.
+    from yt_dlp.extractor.facebook import (
+        FacebookAdsIE,
+        FacebookIE,
+        FacebookPluginsVideoIE,
+        FacebookRedirectURLIE,
+        FacebookReelIE,
+    )
+    from yt_dlp.extractor.generic import GenericIE
+    from yt_dlp.extractor.instagram import (
+        InstagramIE,
+        InstagramIOSIE,
+        InstagramStoryIE,
+        InstagramTagIE,
+        InstagramUserIE,
+    )
+
+    return (
+        FacebookAdsIE,
+        FacebookIE,
+        FacebookPluginsVideoIE,
+        FacebookRedirectURLIE,
+        FacebookReelIE,
+        InstagramIE,
+        InstagramIOSIE,
+        InstagramStoryIE,
+        InstagramTagIE,
+        InstagramUserIE,
+        GenericIE,
+    )
+
+
+def load_youtubedl():
+    # yt-dlp dominates cold start, so it is only imported once an attempt
+    # actually needs it; auth/validation failures never pay for it.
+    global _YoutubeDL, _extractors
+    if _YoutubeDL is None:
+        with _ytdlp_lock:
+            if _YoutubeDL is None:
+                started = time.perf_counter()
+                from yt_dlp import YoutubeDL
+
+                if YTDLP_TRIMMED_EXTRACTORS:
+                    _extractors = import_trimmed_extractors()
+                IMPORT_TIMINGS["yt_dlp_ms"] = round(
+                    (time.perf_counter() - started) * 1000, 1
+                )
+                _YoutubeDL = YoutubeDL
+    return _YoutubeDL
+
+
+def new_youtubedl(ydl_opts: dict):
+    YoutubeDL = load_youtubedl()
+    if not YTDLP_TRIMMED_EXTRACTORS:
+        return YoutubeDL(ydl_opts)
+    ydl = YoutubeDL(ydl_opts, auto_init=False)
+    for extractor in _extractors:
+        ydl.add_info_extractor(extractor())
+    return ydl
+
+
+class YoutubeDLPool:
+    # Building a YoutubeDL loads the extractor registry, cookie jar and request
+    # handlers, so warm instances are reused. Each one is lent to a single
+    # thread at a time and returned afterwards.
+    def __init__(self, max_idle: int) -> None:
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._idle: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(ydl_opts: dict, cookies: tuple) -> str:
+        # Cookies live in each instance's jar, so a changed cookie set keys a
+        # fresh set of instances.
+        jar = [(cookie.name, cookie.value) for cookie in cookies]
+        return json.dumps([ydl_opts, jar], sort_keys=True, default=repr)
+
+    @staticmethod
+    def _build(ydl_opts: dict, cookies: tuple):
+        # YoutubeDL fills defaults into its params dict in place; building from
+        # a copy keeps the caller's opts, and so the pool key, unchanged.
+        ydl = new_youtubedl(copy.deepcopy(ydl_opts))
+        for cookie in cookies:
+            ydl.cookiejar.set_cookie(copy.copy(cookie))
+        return ydl
+
+    def _acquire(self, key: str, ydl_opts: dict, cookies: tuple):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.created += 1
+        return self._build(ydl_opts, cookies)
+
+    def _release(self, key: str, ydl) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(ydl)
+                return
+        ydl.close()
+
+    @contextmanager
+    def borrow(self, ydl_opts: dict, cookies: tuple = ()):
+        key = self.key_for(ydl_opts, cookies)
+        ydl = self._acquire(key, ydl_opts, cookies)
+        try:
+            yield ydl
+        finally:
+            self._release(key, ydl)
+
+    def prewarm(self, ydl_opts: dict, count: int, cookies: tuple = ()) -> None:
+        key = self.key_for(ydl_opts, cookies)
+        built = [self._build(ydl_opts, cookies) for _ in range(count)]
+        with self._lock:
+            self.created += len(built)
+        for ydl in built:
+            self._release(key, ydl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+        return {"created": self.created, "reused": self.reused, "idle": idle}
+
+
+YTDLP_POOL = YoutubeDLPool(YTDLP_POOL_SIZE)
+
+
+class ConnectionPool:
+    # Keep-alive HTTP(S) connections shared across requests in a warm worker,
+    # at most max_per_host open per origin. A connection goes back to the pool
+    # only when its response body was read to the end.
+    def __init__(self, max_per_host: int) -> None:
+        self.max_per_host = max_per_host
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self._ssl_context = ssl.create_default_context()
+        self._idle: dict[tuple, list] = {}
+        self._slots: dict[tuple, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _checkout(self, origin: tuple, timeout: float):
+        with self._lock:
+            slot = self._slots.get(origin)
+            if slot is None:
+                slot = self._slots[origin] = threading.BoundedSemaphore(
+                    self.max_per_host
+                )
+        if not slot.acquire(timeout=timeout):
+            raise TimeoutError(f"no free connection to {origin[1]}")
+
+        with self._lock:
+            idle = self._idle.get(origin, [])
+            while idle:
+                conn, idle_since = idle.pop()
+                if time.monotonic() - idle_since < HTTP_POOL_IDLE_TIMEOUT:
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+            self.created += 1
+
+        scheme, host, port = origin
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=timeout, context=self._ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        return conn, False
+
+    def _checkin(self, origin: tuple, conn, reusable: bool) -> None:
+        with self._lock:
+            if reusable:
+                self._idle.setdefault(origin, []).append((conn, time.monotonic()))
+            else:
+                self.discarded += 1
+        if not reusable:
+            conn.close()
+        self._slots[origin].release()
+
+    def _send(self, origin: tuple, target: str, headers: dict, timeout: float):
+        conn, reused = self._checkout(origin, timeout)
+        try:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            conn.request("GET", target, headers=headers)
+            return conn, conn.getresponse()
+        except Exception as exc:
+            self._checkin(origin, conn, False)
+            # The server may have closed a pooled socket while it sat idle.
+            if reused and isinstance(
+                exc, (http.client.RemoteDisconnected, ConnectionError)
+            ):
+                return self._send(origin, target, headers, timeout)
+            raise
+
+    def _follow(self, url: str, headers: dict, timeout: float, stop=None):
+        # Follows redirects until a non-redirect response, or until stop(url) says the
+        # target is good enough; then nothing is left open.
+        redirects = 0
+        while True:
+            parsed = urlparse(url)
+            scheme = parsed.scheme.lower()
+            default_port = 443 if scheme == "https" else 80
+            origin = (scheme, parsed.hostname, parsed.port or default_port)
+            target = urlunparse(
+                ("", "", parsed.path or "/", parsed.params, parsed.query, "")
+            )
+            conn, response = self._send(origin, target, headers, timeout)
+
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                self._checkin(origin, conn, not response.will_close)
+                redirects += 1
+                if redirects > MAX_REDIRECTS:
+                    raise HTTPError(
+                        url, response.status, "Too many redirects", response.headers, None
+                    )
+                url = urljoin(url, location)
+                if stop is not None and stop(url):
+                    return url, None, None, None
+                continue
+            if response.status >= 400:
+                self._checkin(origin, conn, False)
+                raise HTTPError(
+                    url, response.status, response.reason, response.headers, None
+                )
+            return url, origin, conn, response
+
+    @contextmanager
+    def open(self, url: str, headers: dict, timeout: float):
+        _, origin, conn, response = self._follow(url, headers, timeout)
+        try:
+            yield response
+        finally:
+            self._checkin(
+                origin, conn, response.isclosed() and not response.will_close
+            )
+
+    def resolve_redirects(self, url: str, headers: dict, timeout: float, stop=None) -> str:
+        # Final URL of a redirect chain. The last page's body is never read.
+        url, origin, conn, response = self._follow(url, headers, timeout, stop)
+        if response is not None:
+            self._checkin(origin, conn, False)
+        return url
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded,
+            "idle": idle,
+        }
+
+
+HTTP_POOL = ConnectionPool(HTTP_POOL_MAX_PER_HOST)
+
+
+def html_headers(cookie_header: str) -> dict:
     headers = {
         "User-Agent": (
             "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) "
@@ -122,41 +1025,99 @@ def fetch_html(url: str, cookie_header: str = "") -> str:
     }
     if cookie_header:
         headers["Cookie"] = cookie_header
+    return headers
 
-    request = Request(
-        url,
-        headers=headers,
-    )
-    with urlopen(request, timeout=25) as response:
-        return response.read().decode("utf-8", errors="ignore")
 
+def expand_short_link(url: str, deadline: Deadline | None = None) -> str:
+    # Short/share link -> the post it redirects to, stopping at the first hop
+    # that names the media. On any failure the link is returned unchanged and
+    # yt-dlp follows the redirects itself.
+    if not is_short_link(url):
+        return url
+    parsed = urlparse(url)
+    cache_key = urlunparse(("https", parsed.hostname.lower(), parsed.path, "", "", ""))
+    cached = SHORT_LINK_CACHE.get(cache_key)
+    if cached is not None:
+        METRICS.inc("extract_short_links_total", outcome="cached")
+        return cached["url"]
 
-def extract_from_public_html(url: str, cookie_header: str = "") -> dict | None:
-    page = fetch_html(url, cookie_header)
-    media_patterns = [
-        r'<meta[^>]+property=["\']og:video(?::secure_url)?["\'][^>]+content=["\']([^"\']+)["\']',
-        r'"video_url":"(https:[^"]+)"',
-        r'"playback_url":"(https:[^"]+)"',
-    ]
+    try:
+        with METRICS.timer("extract_stage_seconds", stage="redirect"):
+            with UPSTREAM.slot(deadline):
+                timeout = deadline.timeout(SHORT_LINK_TIMEOUT) if deadline else SHORT_LINK_TIMEOUT
+                target = HTTP_POOL.resolve_redirects(
+                    url, html_headers(""), timeout, stop=lambda u: media_key(u) is not None
+                )
+    except Exception:
+        METRICS.inc("extract_short_links_total", outcome="error")
+        return url
+    # A chain ending elsewhere (login page, consent wall) is not worth caching;
+    # yt-dlp gets the original link and follows it itself.
+    if media_key(target) is None:
+        METRICS.inc("extract_short_links_total", outcome="unresolved")
+        return url
+    METRICS.inc("extract_short_links_total", outcome="resolved")
+    SHORT_LINK_CACHE.set(cache_key, {"url": target}, SHORT_LINK_TTL)
+    return target
+
+
+def scan_html(response) -> dict[str, str]:
+    # Single precompiled pass over the page as it streams in. Reading stops as
+    # soon as a media URL and the title are known; a short remainder is then
+    # drained so the connection is reused, a long one stays on the socket.
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    found: dict[str, str] = {}
+    buffer = ""
+    while True:
+        chunk = response.read(HTML_CHUNK_SIZE)
+        buffer += decoder.decode(chunk, final=not chunk)
+        for match in HTML_SCAN_RE.finditer(buffer):
+            found.setdefault(match.lastgroup, match.group(match.lastgroup))
+        if not chunk:
+            return found
+        if "title" in found and any(g in found for g in HTML_MEDIA_GROUPS):
+            drain_body(response)
+            return found
+        buffer = buffer[-HTML_SCAN_OVERLAP:]
+
+
+def drain_body(response) -> None:
+    # length is what's left of a Content-Length body (None when chunked).
+    if response.length is not None and response.length > HTML_DRAIN_LIMIT:
+        return
+    drained = 0
+    while drained <= HTML_DRAIN_LIMIT:
+        chunk = response.read(HTML_CHUNK_SIZE)
+        if not chunk:
+            return
+        drained += len(chunk)
+
+
+def extract_from_public_html(
+    url: str,
+    cookie_header: str = "",
+    deadline: Deadline | None = None,
+    governor: RateGovernor | None = None,
+) -> dict | None:
+    with (governor or UPSTREAM).slot(deadline):
+        timeout = deadline.timeout(HTML_TIMEOUT) if deadline else HTML_TIMEOUT
+        with HTTP_POOL.open(url, html_headers(cookie_header), timeout) as response:
+            found = scan_html(response)
 
     media_url = ""
-    for pattern in media_patterns:
-        match = re.search(pattern, page, flags=re.IGNORECASE)
-        if match:
-            media_url = decode_escaped_url(match.group(1))
+    for group in HTML_MEDIA_GROUPS:
+        if group in found:
+            media_url = decode_escaped_url(found[group])
             break
 
     if not media_url.startswith("http"):
+        if "login_wall" in found:
+            raise Exception(LOGIN_WALL_MESSAGE)
         return None
 
     title = "reel"
-    title_match = re.search(
-        r'<meta[^>]+property=["\']og:title["\'][^>]+content=["\']([^"\']+)["\']',
-        page,
-        flags=re.IGNORECASE,
-    )
-    if title_match:
-        title = html.unescape(title_match.group(1)).strip() or "reel"
+    if "title" in found:
+        title = html.unescape(found["title"]).strip() or "reel"
 
     ext = "mp4"
     path = urlparse(media_url).path
@@ -167,118 +1128,650 @@ def extract_from_public_html(url: str, cookie_header: str = "") -> dict | None:
     return {"url": media_url, "title": title, "ext": ext}
 
 
+def rank_variants(info: dict) -> list[dict]:
+    # Progressive (muxed, directly downloadable) renditions only, best first.
+    # DASH/HLS pieces need merging and can't be streamed through download.php.
+    duration = info.get("duration")
+    variants: list[dict] = []
+    seen: set[str] = set()
+    for fmt in info.get("formats") or []:
+        url = fmt.get("url")
+        if not isinstance(url, str) or not url.startswith("http") or url in seen:
+            continue
+        if fmt.get("vcodec") == "none" or fmt.get("acodec") == "none":
+            continue
+        if fmt.get("protocol") not in (None, "http", "https"):
+            continue
+        tbr = fmt.get("tbr")
+        size = fmt.get("filesize") or fmt.get("filesize_approx")
+        if not size and tbr and duration:
+            size = tbr * 1000 / 8 * duration
+        if not size and duration and fmt.get("width") and fmt.get("height"):
+            fps = fmt.get("fps") or VARIANT_DEFAULT_FPS
+            size = fmt["width"] * fmt["height"] * fps * VARIANT_BITS_PER_PIXEL / 8 * duration
+        seen.add(url)
+        variants.append(
+            {
+                "url": url,
+                "format_id": str(fmt.get("format_id") or ""),
+                "ext": str(fmt.get("ext") or "mp4"),
+                "width": fmt.get("width"),
+                "height": fmt.get("height"),
+                "bitrate_kbps": round(tbr) if tbr else None,
+                "estimated_bytes": int(size) if size else None,
+            }
+        )
+    variants.sort(
+        key=lambda v: (v["height"] or 0, v["bitrate_kbps"] or 0, v["estimated_bytes"] or 0),
+        reverse=True,
+    )
+    return variants
+
+
+def is_truthy(value) -> bool:
+    return value is True or str(value).strip().lower() in ("1", "true", "yes")
+
+
+def parse_limits(body: dict) -> tuple[int | None, int | None]:
+    limits = []
+    for name in ("max_height", "max_bytes"):
+        value = body.get(name)
+        if value is None or value == "":
+            limits.append(None)
+            continue
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            number = 0
+        if number <= 0:
+            raise ValueError(f"{name} must be a positive integer")
+        limits.append(number)
+    return limits[0], limits[1]
+
+
+def select_variant(
+    payload: dict, max_height: int | None, max_bytes: int | None
+) -> dict:
+    # Best variant within the limits; if none fits, the smallest one. Results
+    # are cached with every variant, so this runs per request, after the cache.
+    if "items" in payload:
+        items = [select_variant(item, max_height, max_bytes) for item in payload["items"]]
+        return {**payload, "items": items}
+    variants = payload.get("variants")
+    # Without any known size the byte limit can't be judged; ignore it rather
+    # than fall back to the smallest variant.
+    if variants and not any(variant["estimated_bytes"] for variant in variants):
+        max_bytes = None
+    if not variants or (max_height is None and max_bytes is None):
+        return payload
+
+    def fits(variant: dict) -> bool:
+        if max_height is not None and (variant["height"] or 0) > max_height:
+            return False
+        if max_bytes is not None and (
+            variant["estimated_bytes"] is None or variant["estimated_bytes"] > max_bytes
+        ):
+            return False
+        return True
+
+    fitting = [variant for variant in variants if fits(variant)]
+    if fitting:
+        chosen = fitting[0]
+    else:
+        chosen = min(
+            variants,
+            key=lambda v: (v["estimated_bytes"] or math.inf, v["height"] or 0),
+        )
+    stem = payload["filename"].rsplit(".", 1)[0]
+    return {
+        **payload,
+        "media_url": chosen["url"],
+        "filename": f"{stem}.{chosen['ext']}",
+        "format_id": chosen["format_id"],
+    }
+
+
+def has_media_url(info) -> bool:
+    if not isinstance(info, dict):
+        return False
+    media_url = info.get("url")
+    return isinstance(media_url, str) and media_url.startswith("http")
+
+
+class StrategyStats:
+    # Rolling success rate and winning latency per (strategy, candidate kind),
+    # used to put the historically fastest winning path first. Pairs without
+    # recent samples score as the prior, which keeps the built-in order.
+    def __init__(self) -> None:
+        self._entries: dict[tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, pair: tuple[str, str], now: float) -> dict:
+        entry = self._entries.get(pair)
+        if entry is None or now - entry["updated"] > STRATEGY_STALE_SECONDS:
+            entry = {
+                "attempts": 0,
+                "success_rate": STRATEGY_PRIOR_SUCCESS,
+                "latency": STRATEGY_PRIOR_LATENCY,
+                "updated": now,
+            }
+        return entry
+
+    def record(self, strategy: str, kind: str, ok: bool, seconds: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry((strategy, kind), now)
+            entry["attempts"] += 1
+            entry["success_rate"] += STRATEGY_EWMA_ALPHA * (
+                (1.0 if ok else 0.0) - entry["success_rate"]
+            )
+            if ok:
+                entry["latency"] += STRATEGY_EWMA_ALPHA * (seconds - entry["latency"])
+            entry["updated"] = now
+            self._entries[(strategy, kind)] = entry
+
+    @staticmethod
+    def _score(entry: dict) -> float:
+        # Expected seconds until this pair produces a win.
+        return entry["latency"] / max(entry["success_rate"], 0.05)
+
+    def score(self, strategy: str, kind: str) -> float:
+        with self._lock:
+            return self._score(self._entry((strategy, kind), time.monotonic()))
+
+    def order(self, attempts: list) -> list:
+        return sorted(attempts, key=lambda attempt: self.score(attempt[0], attempt[1]))
+
+    def snapshot(self) -> list[dict]:
+        now = time.monotonic()
+        with self._lock:
+            entries = {pair: self._entry(pair, now) for pair in self._entries}
+        rows = []
+        for (strategy, kind), entry in entries.items():
+            rows.append({
+                "strategy": strategy,
+                "kind": kind,
+                "attempts": entry["attempts"],
+                "success_rate": round(entry["success_rate"], 3),
+                "latency_ms": round(entry["latency"] * 1000, 1),
+                "score": round(self._score(entry), 3),
+            })
+        return sorted(rows, key=lambda row: row["score"])
+
+
+STRATEGY_STATS = StrategyStats()
+
+
+def run_attempt(strategy: str, kind: str, attempt):
+    started = time.monotonic()
+    try:
+        info = attempt()
+    except (DeadlineExceeded, UpstreamThrottled):
+        METRICS.inc("extract_attempts_skipped_total", strategy=strategy, kind=kind)
+        raise
+    except Exception:
+        elapsed = time.monotonic() - started
+        STRATEGY_STATS.record(strategy, kind, False, elapsed)
+        METRICS.observe(
+            "extract_attempt_seconds", elapsed, strategy=strategy, kind=kind, outcome="error"
+        )
+        raise
+    elapsed = time.monotonic() - started
+    ok = has_media_url(info)
+    STRATEGY_STATS.record(strategy, kind, ok, elapsed)
+    outcome = "ok" if ok else "empty"
+    METRICS.observe(
+        "extract_attempt_seconds", elapsed, strategy=strategy, kind=kind, outcome=outcome
+    )
+    return info
+
+
+def race_attempts(
+    attempts: list, errors: list[str], deadline: Deadline
+) -> dict | None:
+    # Hedged race over (strategy, kind, callable) attempts: they start in order,
+    # each HEDGE_DELAY after the previous one (or right away when an earlier
+    # attempt fails). The first result with a media URL wins; queued attempts
+    # are cancelled and running ones abandoned, as is everything still pending
+    # once the deadline passes.
+    executor = ThreadPoolExecutor(max_workers=RACE_WORKERS)
+    labels = {}
+    pending = set()
+    next_index = 0
+    next_start = time.monotonic()
+    try:
+        while next_index < len(attempts) or pending:
+            if deadline.expired():
+                if next_index < len(attempts) or pending:
+                    errors.append("deadline: request budget exhausted")
+                return None
+
+            now = time.monotonic()
+            if next_index < len(attempts) and (now >= next_start or not pending):
+                strategy, kind, attempt = attempts[next_index]
+                next_index += 1
+                future = executor.submit(run_attempt, strategy, kind, attempt)
+                labels[future] = (strategy, kind)
+                pending.add(future)
+                next_start = now + HEDGE_DELAY
+                continue
+
+            timeout = deadline.remaining()
+            if next_index < len(attempts):
+                timeout = min(timeout, next_start - now)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    info = future.result()
+                except Exception as exc:
+                    errors.append(f"{labels[future][0]}: {str(exc)}")
+                    next_start = time.monotonic()
+                    continue
+                if has_media_url(info):
+                    strategy, kind = labels[future]
+                    METRICS.inc("extract_wins_total", strategy=strategy, kind=kind)
+                    return info
+                if isinstance(info, dict):
+                    errors.append(f"{labels[future][0]}: no downloadable media URL")
+                next_start = time.monotonic()
+        return None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_media(url: str, deadline: Deadline) -> tuple[int, dict]:
+    session = SESSIONS.acquire()
+    cookie_header = session.cookie_header
+    governor = session.governor
+
+    def run_ytdlp(candidate_url: str) -> dict | None:
+        with governor.slot(deadline):
+            socket_timeout = deadline.timeout(YTDLP_SOCKET_TIMEOUT)
+            ydl_opts = build_ydl_opts(socket_timeout)
+            with YTDLP_POOL.borrow(ydl_opts, session.cookies) as ydl:
+                return ydl.extract_info(candidate_url, download=False)
+
+    candidates = build_candidates(url)
+    ytdlp_attempts = [
+        ("yt-dlp", kind, lambda c=c: run_ytdlp(c)) for kind, c in candidates
+    ]
+    html_attempts = [
+        (
+            "html",
+            kind,
+            lambda c=c: extract_from_public_html(c, cookie_header, deadline, governor),
+        )
+        for kind, c in candidates
+    ]
+
+    errors: list[str] = []
+    if HTML_FIRST and canonical_key(url).startswith("instagram:"):
+        info = race_attempts(STRATEGY_STATS.order(html_attempts), errors, deadline)
+        if info is None and not deadline.expired():
+            info = race_attempts(STRATEGY_STATS.order(ytdlp_attempts), errors, deadline)
+    else:
+        attempts = STRATEGY_STATS.order(ytdlp_attempts + html_attempts)
+        info = race_attempts(attempts, errors, deadline)
+
+    if info is None and deadline.expired():
+        payload = {"error": "Video extract timed out. Please try again."}
+        if errors:
+            payload["detail"] = " | ".join(errors)[:320]
+        return 504, payload
+
+    if info is None and errors and all(THROTTLED_MESSAGE in e for e in errors):
+        # Every attempt was shed locally; nothing reached upstream, so say when
+        # to come back instead of reporting (and caching) an extract failure.
+        return 503, {
+            "error": "Upstream is rate-limiting us. Please retry shortly.",
+            "retry_after": governor.retry_after(),
+        }
+
+    if not isinstance(info, dict):
+        payload = {
+            "error": "Video extract failed. Reel may be restricted or rate-limited."
+        }
+        reason = classify_failure(errors)
+        SESSIONS.report(session, session_failure(errors))
+        if reason:
+            payload["reason"] = reason
+        combined = " | ".join(errors).lower()
+        if (
+            ("login required" in combined or "rate-limit" in combined)
+            and not cookie_header
+        ):
+            payload["hint"] = (
+                "Set INSTAGRAM_SESSIONID (or INSTAGRAM_COOKIES) in Vercel "
+                "Environment Variables, then redeploy."
+            )
+        if errors:
+            payload["detail"] = " | ".join(errors)[:320]
+        return 422, payload
+
+    SESSIONS.report(session, None)
+    media_url = info["url"]
+    title = str(info.get("title") or "reel")
+    ext = str(info.get("ext") or "mp4")
+    filename = sanitize_filename(title, ext)
+
+    payload = {"media_url": media_url, "filename": filename}
+    variants = rank_variants(info)
+    if variants:
+        payload["variants"] = variants
+    return 200, payload
+
+
+def entry_payload(entry: dict, title: str) -> dict | None:
+    # Carousel entries come back extracted but not format-selected, so the
+    # best progressive variant stands in for yt-dlp's pick; photo entries have
+    # no formats, only image candidates.
+    variants = rank_variants(entry)
+    if has_media_url(entry):
+        payload = {"type": "video", "media_url": entry["url"]}
+        ext = str(entry.get("ext") or "mp4")
+    elif variants:
+        payload = {"type": "video", "media_url": variants[0]["url"]}
+        ext = variants[0]["ext"]
+    else:
+        images = [
+            thumb for thumb in entry.get("thumbnails") or []
+            if str(thumb.get("url") or "").startswith("http")
+        ]
+        if not images:
+            return None
+        best = max(images, key=lambda t: (t.get("width") or 0) * (t.get("height") or 0))
+        payload = {"type": "image", "media_url": best["url"]}
+        path = urlparse(best["url"]).path
+        ext = path.rsplit(".", 1)[-1].lower() if "." in path else "jpg"
+    payload["filename"] = sanitize_filename(title, ext)
+    if variants:
+        payload["variants"] = variants
+    return payload
+
+
+def extract_all_media(url: str, deadline: Deadline) -> tuple[int, dict]:
+    # Expands a carousel/multi-video post into every entry. Extractors that
+    # return references instead of finished entries get those resolved
+    # concurrently, CAROUSEL_WORKERS at a time, within the same deadline.
+    session = SESSIONS.acquire()
+    governor = session.governor
+
+    def extract(target: str, process: bool) -> dict:
+        with governor.slot(deadline):
+            ydl_opts = build_ydl_opts(deadline.timeout(YTDLP_SOCKET_TIMEOUT), noplaylist=False)
+            with YTDLP_POOL.borrow(ydl_opts, session.cookies) as ydl:
+                return ydl.extract_info(target, download=False, process=process)
+
+    try:
+        info = extract(url, False)
+    except DeadlineExceeded:
+        return 504, {"error": "Video extract timed out. Please try again."}
+    except UpstreamThrottled:
+        return 503, {
+            "error": "Upstream is rate-limiting us. Please retry shortly.",
+            "retry_after": governor.retry_after(),
+        }
+    except Exception as exc:
+        reason = classify_error(str(exc))
+        SESSIONS.report(session, session_failure([str(exc)]))
+        payload = {"error": "Post extract failed. It may be restricted or rate-limited."}
+        if reason:
+            payload["reason"] = reason
+        payload["detail"] = str(exc)[:320]
+        return 422, payload
+    SESSIONS.report(session, None)
+
+    entries = [info]
+    if info.get("_type") in ("playlist", "multi_video"):
+        entries = [e for e in info.get("entries") or [] if isinstance(e, dict)]
+    entries = entries[:CAROUSEL_MAX_ITEMS]
+    title = str(info.get("title") or "post")
+
+    items: list[dict | None] = [None] * len(entries)
+    references = {}
+    for index, entry in enumerate(entries):
+        name = f"{title}_{index + 1}" if len(entries) > 1 else title
+        if entry.get("_type") in ("url", "url_transparent"):
+            references[index] = name
+        else:
+            items[index] = entry_payload(entry, name)
+
+    if references:
+        executor = ThreadPoolExecutor(max_workers=CAROUSEL_WORKERS)
+        try:
+            futures = {
+                executor.submit(extract, entries[index]["url"], True): index
+                for index in references
+            }
+            done, _ = wait(futures, timeout=deadline.remaining())
+            for future in done:
+                index = futures[future]
+                try:
+                    items[index] = entry_payload(future.result(), references[index])
+                except Exception as exc:
+                    items[index] = {"error": str(exc)[:320]}
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    items = [item or {"error": "No downloadable media found"} for item in items]
+    resolved = [item for item in items if "media_url" in item]
+    if not resolved:
+        return 422, {"error": "No downloadable media found in this post."}
+    return 200, {
+        "media_url": resolved[0]["media_url"],
+        "filename": resolved[0]["filename"],
+        "items": items,
+    }
+
+
+def result_ttl(payload: dict) -> int:
+    urls = [item["media_url"] for item in payload.get("items", []) if "media_url" in item]
+    return min(cache_ttl_for(media_url) for media_url in urls or [payload["media_url"]])
+
+
+def resolve(url: str, deadline: Deadline, all_media: bool = False) -> tuple[int, dict]:
+    url = expand_short_link(url, deadline)
+    key = canonical_key(url) + ("#all" if all_media else "")
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        return 200, cached
+    failure = FAILURE_CACHE.get(key)
+    if failure is not None:
+        METRICS.inc("extract_failure_cache_hits_total", reason=failure["reason"])
+        return 422, failure
+
+    with METRICS.timer("extract_stage_seconds", stage="extract"):
+        if all_media:
+            status, payload = extract_all_media(url, deadline)
+        else:
+            status, payload = extract_media(url, deadline)
+    if status == 200:
+        RESULT_CACHE.set(key, payload, result_ttl(payload))
+    elif status == 422 and "reason" in payload:
+        FAILURE_CACHE.set(key, payload, FAILURE_CACHE_TTLS[payload["reason"]])
+    return status, payload
+
+
+def batch_line(url: str, status: int, payload: dict) -> bytes:
+    if status == 200:
+        item = {"ok": True, **payload, "source": url}
+    else:
+        item = {"ok": False, "status": status, **payload, "source": url}
+    return (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+
+
 class handler(BaseHTTPRequestHandler):
     def _send(self, status_code: int, payload: dict) -> None:
-        self.send_response(status_code)
-        self.send_header("Content-Type", "application/json; charset=utf-8")
-        self.end_headers()
-        self.wfile.write(
-            json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        METRICS.inc("extract_responses_total", status=str(status_code))
+        with METRICS.timer("extract_stage_seconds", stage="serialize"):
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            if "retry_after" in payload:
+                self.send_header("Retry-After", str(payload["retry_after"]))
+            self.end_headers()
+            self.wfile.write(
+                json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            )
+
+    def _send_metrics(self) -> None:
+        gauges = {
+            "extract_cache_hits": RESULT_CACHE.hits,
+            "extract_cache_misses": RESULT_CACHE.misses,
+            "extract_cache_entries": len(RESULT_CACHE),
+            "extract_failure_cache_entries": len(FAILURE_CACHE),
+            "extract_short_link_cache_entries": len(SHORT_LINK_CACHE),
+        }
+        for name, value in HTTP_POOL.stats().items():
+            gauges[f"extract_http_pool_{name}"] = value
+        for name, value in YTDLP_POOL.stats().items():
+            gauges[f"extract_ytdlp_pool_{name}"] = value
+        for name, value in UPSTREAM.stats().items():
+            gauges[f"extract_upstream_{name}"] = value
+        sessions = SESSIONS.stats()
+        gauges["extract_sessions_configured"] = len(sessions)
+        gauges["extract_sessions_quarantined"] = sum(
+            1 for session in sessions if session["quarantined_for"] > 0
         )
 
-    def do_GET(self):
-        if self.path == "/api/extract":
-            return self._send(200, {"ok": True, "service": "reel-extractor"})
-        return self._send(404, {"error": "Not found"})
+        body = METRICS.render(gauges).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-    def do_POST(self):
-        if self.path != "/api/extract":
-            return self._send(404, {"error": "Not found"})
+    def _route(self) -> str:
+        return urlparse(self.path).path.rstrip("/")
 
+    def _read_authorized_body(self) -> dict | None:
         auth = self.headers.get("Authorization", "")
         if not API_TOKEN:
-            return self._send(500, {"error": "API_TOKEN missing on server"})
+            self._send(500, {"error": "API_TOKEN missing on server"})
+            return None
         if auth != f"Bearer {API_TOKEN}":
-            return self._send(401, {"error": "Unauthorized"})
+            self._send(401, {"error": "Unauthorized"})
+            return None
 
         length = int(self.headers.get("Content-Length", "0"))
         raw = self.rfile.read(length).decode("utf-8") if length > 0 else "{}"
         try:
             body = json.loads(raw)
         except Exception:
-            return self._send(400, {"error": "Invalid JSON body"})
+            body = None
+        if not isinstance(body, dict):
+            self._send(400, {"error": "Invalid JSON body"})
+            return None
+        return body
+
+    def do_GET(self):
+        if self._route() == "/api/extract/metrics":
+            return self._send_metrics()
+        if self._route() == "/api/extract/stats":
+            return self._send(
+                200,
+                {"strategies": STRATEGY_STATS.snapshot(), "sessions": SESSIONS.stats()},
+            )
+        if self._route() == "/api/extract":
+            return self._send(
+                200,
+                {
+                    "ok": True,
+                    "service": "reel-extractor",
+                    "http_pool": HTTP_POOL.stats(),
+                    "ytdlp_pool": YTDLP_POOL.stats(),
+                    "imports": IMPORT_TIMINGS,
+                },
+            )
+        return self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        deadline = Deadline(REQUEST_BUDGET)
+        route = self._route()
+        if route == "/api/extract/batch":
+            return self._batch(deadline)
+        if route != "/api/extract":
+            return self._send(404, {"error": "Not found"})
+
+        with METRICS.timer("extract_stage_seconds", stage="auth"):
+            body = self._read_authorized_body()
+        if body is None:
+            return
 
-        url = str(body.get("url", "")).strip()
+        with METRICS.timer("extract_stage_seconds", stage="validate"):
+            url = str(body.get("url", "")).strip()
+            supported = bool(url) and is_supported_url(url)
         if not url:
             return self._send(400, {"error": "URL required"})
-        if not is_supported_url(url):
+        if not supported:
             return self._send(
                 400, {"error": "Only Instagram/Facebook URLs supported"}
             )
+        try:
+            max_height, max_bytes = parse_limits(body)
+        except ValueError as exc:
+            return self._send(400, {"error": str(exc)})
+        all_media = is_truthy(body.get("all_media"))
 
-        ydl_opts = {
-            "quiet": True,
-            "no_warnings": True,
-            "skip_download": True,
-            "nocheckcertificate": False,
-            "noplaylist": True,
-            "http_headers": {
-                "User-Agent": (
-                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/124.0.0.0 Safari/537.36"
-                ),
-                "Referer": "https://www.instagram.com/",
-            },
-        }
-        cookie_header = build_cookie_header()
-        cookiefile = build_cookiefile()
-        if cookie_header:
-            ydl_opts["http_headers"]["Cookie"] = cookie_header
-        if cookiefile:
-            ydl_opts["cookiefile"] = cookiefile
-
-        info = None
-        errors: list[str] = []
-        for candidate_url in build_candidate_urls(url):
-            try:
-                with YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(candidate_url, download=False)
-                if isinstance(info, dict):
-                    break
-            except Exception as exc:
-                errors.append(f"yt-dlp: {str(exc)}")
+        status, payload = resolve(url, deadline, all_media)
+        if status == 200:
+            payload = select_variant(payload, max_height, max_bytes)
+            return self._send(200, {"ok": True, **payload, "source": url})
+        return self._send(status, payload)
 
-        if not isinstance(info, dict):
-            for candidate_url in build_candidate_urls(url):
-                try:
-                    info = extract_from_public_html(candidate_url, cookie_header)
-                    if isinstance(info, dict):
-                        break
-                except Exception as exc:
-                    errors.append(f"html: {str(exc)}")
+    def _batch(self, deadline: Deadline):
+        body = self._read_authorized_body()
+        if body is None:
+            return
 
-        if not isinstance(info, dict):
-            payload = {
-                "error": "Video extract failed. Reel may be restricted or rate-limited."
-            }
-            combined = " | ".join(errors).lower()
-            if (
-                ("login required" in combined or "rate-limit" in combined)
-                and not cookie_header
-            ):
-                payload["hint"] = (
-                    "Set INSTAGRAM_SESSIONID (or INSTAGRAM_COOKIES) in Vercel "
-                    "Environment Variables, then redeploy."
-                )
-            if errors:
-                payload["detail"] = " | ".join(errors)[:320]
-            return self._send(422, payload)
+        urls = body.get("urls")
+        if not isinstance(urls, list) or not urls:
+            return self._send(400, {"error": "urls must be a non-empty list"})
+        if len(urls) > BATCH_MAX_URLS:
+            return self._send(
+                400, {"error": f"At most {BATCH_MAX_URLS} URLs per batch"}
+            )
+        try:
+            max_height, max_bytes = parse_limits(body)
+        except ValueError as exc:
+            return self._send(400, {"error": str(exc)})
+        all_media = is_truthy(body.get("all_media"))
 
-        media_url = info.get("url")
-        if not isinstance(media_url, str) or not media_url.startswith("http"):
-            return self._send(422, {"error": "No downloadable media URL found"})
+        # One line per submitted URL, written as soon as its shortcode resolves.
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.end_headers()
 
-        title = str(info.get("title") or "reel")
-        ext = str(info.get("ext") or "mp4")
-        filename = sanitize_filename(title, ext)
+        accepted: list[str] = []
+        for value in urls:
+            url = str(value or "").strip()
+            if not url or not is_supported_url(url):
+                error = {"error": "Only Instagram/Facebook URLs supported"}
+                self.wfile.write(batch_line(url, 400, error))
+                continue
+            accepted.append(url)
+        self.wfile.flush()
 
-        return self._send(
-            200,
-            {
-                "ok": True,
-                "media_url": media_url,
-                "filename": filename,
-                "source": url,
-            },
-        )
+        executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+        try:
+            # Short links are expanded first so two links to the same post
+            # share one extraction; resolve() then finds them cached.
+            targets = executor.map(lambda u: expand_short_link(u, deadline), accepted)
+            by_key: dict[str, list[str]] = {}
+            for url, target in zip(accepted, targets):
+                by_key.setdefault(canonical_key(target), []).append(url)
+            futures = {
+                executor.submit(resolve, sources[0], deadline, all_media): key
+                for key, sources in by_key.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    status, payload = future.result()
+                except Exception as exc:
+                    status, payload = 500, {"error": f"Extraction crashed: {exc}"}
+                if status == 200:
+                    payload = select_variant(payload, max_height, max_bytes)
+                for url in by_key[futures[future]]:
+                    self.wfile.write(batch_line(url, status, payload))
+                self.wfile.flush()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
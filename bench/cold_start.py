@@ -0,0 +1,57 @@
+"""Cold-start cost of the Vercel function with and without yt-dlp loaded.
+
+Each sample imports api/extract.py in a fresh interpreter, the way a cold
+serverless instance does:
+
+    python bench/cold_start.py --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+SCENARIOS = {
+    # What every request paid before yt-dlp was imported lazily.
+    "eager (module + yt-dlp)": "import extract; extract.load_youtubedl()",
+    # Auth/validation failures and HTML_FIRST hits now stop here.
+    "lazy (module only)": "import extract",
+    "yt-dlp alone": "import yt_dlp",
+}
+
+PROBE = """
+import time
+started = time.perf_counter()
+{statement}
+print((time.perf_counter() - started) * 1000)
+"""
+
+
+def sample(statement: str) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement)],
+        cwd=API_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    for label, statement in SCENARIOS.items():
+        samples = sorted(sample(statement) for _ in range(args.runs))
+        print(
+            f"{label:<26} median={statistics.median(samples):8.1f} ms  "
+            f"min={samples[0]:8.1f} ms  max={samples[-1]:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
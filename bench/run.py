@@ -0,0 +1,267 @@
+"""Offline throughput/latency benchmark against the local Instagram stand-in.
+
+Targets:
+    html     extract.extract_from_public_html() called directly
+    handler  the Vercel handler served in-process, driven over HTTP
+    flask    the self-hosted Flask extract() view through its test client
+
+instagram.com traffic is routed to bench/standin.py and yt-dlp is replaced by a
+stand-in that fetches the same fixtures, so no network access is needed:
+
+    python bench/run.py --target handler --requests 500 --concurrency 16
+    python bench/run.py --target flask --mix reel=80,slow=10,limited=5,private=5
+
+The upstream rate governor is unbounded by default so runs measure the
+extractors; pass --upstream-rate to put the production governor back in front.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.error import HTTPError
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "self_api"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import extract  # noqa: E402
+from standin import QuietServer, start_standin  # noqa: E402
+
+API_TOKEN = "bench-token"
+# Set from --upstream-rate; 0 means no rate limiting at all.
+UPSTREAM_RATE = 0.0
+
+
+class StandinPool(extract.ConnectionPool):
+    # Sends every origin to the stand-in while keeping the pool's own logic.
+    def __init__(self, port: int, max_per_host: int) -> None:
+        super().__init__(max_per_host)
+        self.standin = ("http", "127.0.0.1", port)
+
+    def _checkout(self, origin: tuple, timeout: float):
+        return super()._checkout(self.standin, timeout)
+
+    def _checkin(self, origin: tuple, conn, reusable: bool) -> None:
+        super()._checkin(self.standin, conn, reusable)
+
+
+class StandinYoutubeDL:
+    # Same fixture, same failure wording as yt-dlp's Instagram extractor.
+    def extract_info(self, url: str, download: bool = False) -> dict:
+        try:
+            info = extract.extract_from_public_html(url)
+        except HTTPError as exc:
+            if exc.code == 429:
+                raise Exception(
+                    "ERROR: [Instagram] Requested content is not available, "
+                    "rate-limit reached or login required"
+                ) from exc
+            raise
+        if info is None:
+            raise Exception("ERROR: [Instagram] login required to access this reel")
+        return info
+
+
+class StandinYoutubeDLPool:
+    created = 0
+    reused = 0
+
+    @contextmanager
+    def borrow(self, ydl_opts: dict, cookies: tuple = ()):
+        yield StandinYoutubeDL()
+
+    def prewarm(self, *args, **kwargs) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"created": 0, "reused": 0, "idle": 0}
+
+
+def bench_governor(module):
+    # module is api/extract.py or self_api/app.py; each has its own RateGovernor.
+    if UPSTREAM_RATE > 0:
+        return module.RateGovernor(
+            UPSTREAM_RATE, module.UPSTREAM_BURST, module.UPSTREAM_MAX_WAIT
+        )
+
+    class UnboundedGovernor(module.RateGovernor):
+        # Never queues or sheds, and the stand-in's 429s do not pause it.
+        def penalize(self) -> None:
+            pass
+
+    return UnboundedGovernor(math.inf, math.inf, 0)
+
+
+def parse_mix(value: str) -> list[tuple[str, int]]:
+    mix = []
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix.append((name.strip(), int(weight or 1)))
+    return mix
+
+
+def make_urls(count: int, mix: list[tuple[str, int]], hot: int) -> list[str]:
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    urls = []
+    for index in range(count):
+        variant = random.choices(names, weights)[0]
+        serial = random.randrange(hot) if hot else index
+        prefix = "" if variant == "reel" else variant
+        urls.append(f"https://www.instagram.com/reel/{prefix}X{serial:06d}/")
+    return urls
+
+
+def html_target(port: int):
+    def call(url: str) -> int:
+        local = url.replace("https://www.instagram.com", f"http://127.0.0.1:{port}")
+        try:
+            info = extract.extract_from_public_html(local)
+        except HTTPError as exc:
+            return exc.code
+        return 200 if info else 422
+
+    return call
+
+
+def handler_target(port: int):
+    server = QuietServer(("127.0.0.1", 0), extract.handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    handler_port = server.server_address[1]
+    extract.handler.log_message = lambda *args: None
+
+    def call(url: str) -> int:
+        conn = http.client.HTTPConnection("127.0.0.1", handler_port, timeout=120)
+        try:
+            conn.request(
+                "POST",
+                "/api/extract",
+                body=json.dumps({"url": url}),
+                headers={
+                    "Authorization": f"Bearer {API_TOKEN}",
+                    "Content-Type": "application/json",
+                },
+            )
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    return call
+
+
+def flask_target(port: int):
+    import app as self_api
+
+    self_api.API_TOKEN = API_TOKEN
+    self_api.UPSTREAM = bench_governor(self_api)
+    self_api.YTDLP_POOL = StandinYoutubeDLPool()
+    local = threading.local()
+
+    def call(url: str) -> int:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = self_api.app.test_client()
+        response = client.post(
+            "/extract",
+            json={"url": url},
+            headers={"Authorization": f"Bearer {API_TOKEN}"},
+        )
+        return response.status_code
+
+    return call
+
+
+TARGETS = {"html": html_target, "handler": handler_target, "flask": flask_target}
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    index = min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=sorted(TARGETS), default="handler")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--mix",
+        default="reel=70,og=10,embed=10,slow=4,limited=3,private=3",
+        help="variant=weight list; variants: reel, og, embed, slow, limited, private",
+    )
+    parser.add_argument(
+        "--hot", type=int, default=0,
+        help="draw shortcodes from this many per variant (exercises caches); 0 = unique",
+    )
+    parser.add_argument("--pad-kb", type=int, default=300)
+    parser.add_argument("--slow-delay", type=float, default=2.0)
+    parser.add_argument("--html-first", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--upstream-rate", type=float, default=0.0,
+        help="upstream requests/s allowed by the rate governor; 0 = unbounded",
+    )
+    args = parser.parse_args()
+
+    global UPSTREAM_RATE
+    UPSTREAM_RATE = args.upstream_rate
+    random.seed(args.seed)
+    standin, port = start_standin(pad_kb=args.pad_kb, slow_delay=args.slow_delay)
+    extract.HTTP_POOL = StandinPool(port, max(4, args.concurrency))
+    extract.YTDLP_POOL = StandinYoutubeDLPool()
+    extract.API_TOKEN = API_TOKEN
+    extract.HTML_FIRST = args.html_first
+    extract.UPSTREAM = bench_governor(extract)
+    # The anonymous session holds the governor it saw at import time.
+    extract.SESSIONS = extract.SessionPool()
+
+    call = TARGETS[args.target](port)
+    urls = make_urls(args.requests, parse_mix(args.mix), args.hot)
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    lock = threading.Lock()
+
+    def one(url: str) -> None:
+        started = time.perf_counter()
+        status = call(url)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, urls))
+    wall = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    standin.shutdown()
+
+    latencies.sort()
+    print(f"target={args.target} requests={len(urls)} concurrency={args.concurrency}")
+    print(f"throughput   {len(urls) / wall:9.1f} req/s  ({wall:.2f} s wall)")
+    print(
+        f"latency ms   p50={percentile(latencies, 0.50) * 1000:8.1f}  "
+        f"p95={percentile(latencies, 0.95) * 1000:8.1f}  "
+        f"p99={percentile(latencies, 0.99) * 1000:8.1f}  "
+        f"mean={statistics.mean(latencies) * 1000:8.1f}"
+    )
+    print(f"statuses     {dict(sorted(statuses.items()))}")
+    print(f"peak rss     {rss_after / 1024:9.1f} MB (+{(rss_after - rss_before) / 1024:.1f} MB)")
+    print(f"http pool    {extract.HTTP_POOL.stats()}")
+
+
+if __name__ == "__main__":
+    main()
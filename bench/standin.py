@@ -0,0 +1,123 @@
+"""Local stand-in for instagram.com that replays the HTML fixtures.
+
+The shortcode prefix picks the behaviour, so one server covers every case:
+
+    /reel/<code>/                  reel page, media URL deep in an inline JSON blob
+    /reel/<code>/embed/captioned/  embed page with playback_url
+    ogXXXX                         page exposing og:video meta tags
+    embedXXXX                      login wall on the reel page, media only on /embed/
+    slowXXXX                       reel page served after --slow-delay seconds
+    limitedXXXX                    HTTP 429
+    privateXXXX                    login wall everywhere
+
+Run standalone with `python bench/standin.py --port 8765`.
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PATH_RE = re.compile(r"/(reel|reels|p)/([A-Za-z0-9_-]+)/?(embed/captioned/?)?")
+# Far-future signed expiry, so results stay cacheable during a run.
+OE = "7FFFFFFF"
+
+
+class QuietServer(ThreadingHTTPServer):
+    # Extractors hang up mid-body on purpose once they have what they need.
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, f"{name}.html"), encoding="utf-8") as handle:
+        return handle.read()
+
+
+def render(template: str, shortcode: str, padding: str) -> bytes:
+    page = (
+        template.replace("{{shortcode}}", shortcode)
+        .replace("{{title}}", f"Bench reel {shortcode}")
+        .replace("{{oe}}", OE)
+        .replace("{{padding}}", padding)
+    )
+    return page.encode("utf-8")
+
+
+def make_handler(pad_kb: int, slow_delay: float):
+    templates = {
+        name: load_fixture(name)
+        for name in ("reel", "embed", "og_video", "login_wall")
+    }
+    # Real pages carry hundreds of KB of markup and inline scripts.
+    block = '<div class="x1n2onr6 x1lliihq"><span dir="auto">filler</span></div>\n'
+    padding = block * max(0, pad_kb * 1024 // len(block))
+
+    class StandinHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        server_version = "instagram-standin"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status: int, body: bytes) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            match = PATH_RE.search(self.path)
+            if not match:
+                return self._reply(404, b"not found")
+            shortcode, is_embed = match.group(2), bool(match.group(3))
+
+            if shortcode.startswith("limited"):
+                return self._reply(429, b"Please wait a few minutes before you try again.")
+            if shortcode.startswith("private"):
+                return self._reply(200, render(templates["login_wall"], shortcode, padding))
+            if shortcode.startswith("slow"):
+                time.sleep(slow_delay)
+
+            if is_embed:
+                name = "embed"
+            elif shortcode.startswith("embed"):
+                name = "login_wall"
+            elif shortcode.startswith("og"):
+                name = "og_video"
+            else:
+                name = "reel"
+            self._reply(200, render(templates[name], shortcode, padding))
+
+    return StandinHandler
+
+
+def start_standin(port: int = 0, pad_kb: int = 300, slow_delay: float = 2.0):
+    server = QuietServer(("127.0.0.1", port), make_handler(pad_kb, slow_delay))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pad-kb", type=int, default=300)
+    parser.add_argument("--slow-delay", type=float, default=2.0)
+    args = parser.parse_args()
+
+    server = QuietServer(
+        ("127.0.0.1", args.port), make_handler(args.pad_kb, args.slow_delay)
+    )
+    print(f"instagram stand-in on http://127.0.0.1:{args.port}/reel/<shortcode>/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Per-request YoutubeDL construction cost vs. the warm YoutubeDLPool.
+
+Run from the repo root (needs yt-dlp installed, no network access):
+
+    python bench/ydl_pool.py --iterations 200
+"""
+import argparse
+import copy
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from yt_dlp import YoutubeDL  # noqa: E402
+
+import extract  # noqa: E402
+
+
+def measure(label: str, iterations: int, fn) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    print(
+        f"{label:<12} mean={statistics.mean(samples):8.3f} ms  "
+        f"p50={samples[len(samples) // 2]:8.3f} ms  "
+        f"p99={samples[int(len(samples) * 0.99) - 1]:8.3f} ms"
+    )
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    ydl_opts = extract.build_ydl_opts(extract.YTDLP_SOCKET_TIMEOUT)
+    pool = extract.YoutubeDLPool(max_idle=4)
+    pool.prewarm(ydl_opts, 1)
+
+    def construct() -> None:
+        with YoutubeDL(copy.deepcopy(ydl_opts)) as ydl:
+            ydl.get_info_extractor("Instagram")
+
+    def borrow() -> None:
+        with pool.borrow(ydl_opts) as ydl:
+            ydl.get_info_extractor("Instagram")
+
+    fresh = measure("construct", args.iterations, construct)
+    pooled = measure("pooled", args.iterations, borrow)
+    # Every borrow must have hit the prewarmed instance, or "pooled" timed builds.
+    assert pool.stats()["created"] == 1, pool.stats()
+    saved = statistics.mean(fresh) - statistics.mean(pooled)
+    print(f"saved per yt-dlp attempt: {saved:.3f} ms  pool={pool.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Per-worker memory and first-request cost of the self-hosted app's yt-dlp setup.
+
+Each scenario runs in a fresh interpreter that imports self_api/app.py (which
+prewarms the YoutubeDL pool) and then forks --workers children, the way
+gunicorn does. With --preload semantics the import happens once in the parent
+and children share its pages copy-on-write; without it every child imports on
+its own. Each child then borrows a pooled YoutubeDL and matches a reel URL
+against its extractors, which is what a worker's first request pays for
+(URL regexes compile lazily on first use).
+
+    python bench/ytdlp_registry.py --workers 2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SELF_API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "self_api")
+
+PROBE = """
+import json, os, sys, time
+
+REEL = "https://www.instagram.com/reel/ABCDEFGHIJK/"
+
+
+def load():
+    started = time.perf_counter()
+    import app
+    return app, (time.perf_counter() - started) * 1000
+
+
+def smaps():
+    values = {}
+    with open("/proc/self/smaps_rollup") as handle:
+        for line in handle:
+            name, _, rest = line.partition(":")
+            if rest.strip().endswith("kB"):
+                values[name] = int(rest.split()[0])
+    return values
+
+
+def worker(app, import_ms, out):
+    if app is None:
+        app, import_ms = load()
+    started = time.perf_counter()
+    with app.YTDLP_POOL.borrow(app.build_ydl_opts(app.YTDLP_SOCKET_TIMEOUT)) as ydl:
+        matched = next(key for key, ie in ydl._ies.items() if ie.suitable(REEL))
+        extractors = len(ydl._ies)
+    first_ms = (time.perf_counter() - started) * 1000
+    mem = smaps()
+    os.write(out, (json.dumps({
+        "import_ms": import_ms,
+        "first_ms": first_ms,
+        "extractors": extractors,
+        "matched": matched,
+        "rss_kb": mem["Rss"],
+        "pss_kb": mem["Pss"],
+        "uss_kb": mem["Private_Clean"] + mem["Private_Dirty"],
+    }) + "\\n").encode())
+
+
+preload, workers = sys.argv[1] == "1", int(sys.argv[2])
+app, import_ms = load() if preload else (None, 0.0)
+read_end, write_end = os.pipe()
+children = []
+for _ in range(workers):
+    pid = os.fork()
+    if pid == 0:
+        worker(app, import_ms, write_end)
+        os._exit(0)
+    children.append(pid)
+os.close(write_end)
+for pid in children:
+    os.waitpid(pid, 0)
+sys.stdout.write(os.fdopen(read_end).read())
+"""
+
+
+def run(trimmed: bool, preload: bool, workers: int) -> list[dict]:
+    env = dict(os.environ, YTDLP_TRIMMED_EXTRACTORS="1" if trimmed else "0")
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, "1" if preload else "0", str(workers)],
+        cwd=SELF_API_DIR,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    print(
+        f"{'registry':<9} {'preload':<8} {'extractors':>10} {'import ms':>10} "
+        f"{'first req ms':>12} {'RSS MB':>8} {'PSS MB':>8} {'USS MB':>8}"
+    )
+    for trimmed in (False, True):
+        for preload in (False, True):
+            samples = run(trimmed, preload, args.workers)
+            mean = {
+                key: sum(sample[key] for sample in samples) / len(samples)
+                for key in ("import_ms", "first_ms", "rss_kb", "pss_kb", "uss_kb")
+            }
+            print(
+                f"{'trimmed' if trimmed else 'full':<9} {'yes' if preload else 'no':<8} "
+                f"{samples[0]['extractors']:>10} {mean['import_ms']:>10.1f} "
+                f"{mean['first_ms']:>12.1f} {mean['rss_kb'] / 1024:>8.1f} "
+                f"{mean['pss_kb'] / 1024:>8.1f} {mean['uss_kb'] / 1024:>8.1f}"
+            )
+    print("per-worker means; import ms is paid once in the parent when preloaded")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,15 @@ if (is_file($configPath)) {
     require_once $configPath;
 }
 
+function isAjaxRequest(): bool
+{
+    return strtolower((string)($_SERVER['HTTP_X_REQUESTED_WITH'] ?? '')) === 'xmlhttprequest';
+}
+
 function fail(string $message, int $status = 400): void
 {
     http_response_code($status);
-    $isAjax = strtolower((string)($_SERVER['HTTP_X_REQUESTED_WITH'] ?? '')) === 'xmlhttprequest';
-    if ($isAjax) {
+    if (isAjaxRequest()) {
         header('Content-Type: application/json; charset=utf-8');
         echo json_encode(['message' => $message], JSON_UNESCAPED_UNICODE | JSON_UNESCAPED_SLASHES);
         exit;
@@ -23,6 +27,14 @@ function fail(string $message, int $status = 400): void
 
 function streamRemoteFile(string $fileUrl, string $downloadName): void
 {
+    // Client ka Range upstream tak jaata hai aur range headers wapas aate hain, taaki resume ho sake.
+    $requestHeaders = [];
+    foreach (['HTTP_RANGE' => 'Range', 'HTTP_IF_RANGE' => 'If-Range'] as $key => $name) {
+        if (!empty($_SERVER[$key])) {
+            $requestHeaders[] = $name . ': ' . $_SERVER[$key];
+        }
+    }
+
     $ch = curl_init($fileUrl);
     curl_setopt_array($ch, [
         CURLOPT_FOLLOWLOCATION => true,
@@ -31,26 +43,66 @@ function streamRemoteFile(string $fileUrl, string $downloadName): void
         CURLOPT_BUFFERSIZE => 8192,
         CURLOPT_HEADER => false,
         CURLOPT_SSL_VERIFYPEER => true,
+        CURLOPT_HTTPHEADER => $requestHeaders,
     ]);
 
-    header('Content-Description: File Transfer');
-    header('Content-Type: application/octet-stream');
-    header('Content-Disposition: attachment; filename="' . $downloadName . '"');
-    header('Cache-Control: no-cache, must-revalidate');
-    header('Pragma: public');
+    $status = 0;
+    $forwarded = [];
+    $started = false;
+    $passThrough = ['content-length', 'content-range', 'accept-ranges', 'etag', 'last-modified'];
+
+    // Redirect hops ke headers bhi aate hain; har naye status line par reset.
+    curl_setopt($ch, CURLOPT_HEADERFUNCTION, static function ($curl, $line) use (&$status, &$forwarded, $passThrough): int {
+        $trimmed = trim($line);
+        if (preg_match('#^HTTP/\S+\s+(\d{3})#', $trimmed, $match)) {
+            $status = (int)$match[1];
+            $forwarded = [];
+        } elseif (str_contains($trimmed, ':')) {
+            [$name, $value] = array_map('trim', explode(':', $trimmed, 2));
+            if (in_array(strtolower($name), $passThrough, true)) {
+                $forwarded[] = $name . ': ' . $value;
+            }
+        }
+        return strlen($line);
+    });
+
+    $sendHeaders = static function () use (&$status, &$forwarded, &$started, $downloadName): void {
+        $started = true;
+        http_response_code($status === 206 ? 206 : 200);
+        header('Content-Description: File Transfer');
+        header('Content-Type: application/octet-stream');
+        header('Content-Disposition: attachment; filename="' . $downloadName . '"');
+        header('Cache-Control: no-cache, must-revalidate');
+        header('Pragma: public');
+        foreach ($forwarded as $line) {
+            header($line);
+        }
+    };
 
-    curl_setopt($ch, CURLOPT_WRITEFUNCTION, static function ($curl, $chunk): int {
+    curl_setopt($ch, CURLOPT_WRITEFUNCTION, static function ($curl, $chunk) use (&$status, &$started, $sendHeaders): int {
+        // Error body file ke roop me mat bhejo; niche fail() sahi message deta hai.
+        if ($status >= 400) {
+            return strlen($chunk);
+        }
+        if (!$started) {
+            $sendHeaders();
+        }
         echo $chunk;
         flush();
         return strlen($chunk);
     });
 
     $ok = curl_exec($ch);
-    $status = (int)curl_getinfo($ch, CURLINFO_HTTP_CODE);
     curl_close($ch);
 
-    if ($ok === false || $status >= 400) {
-        fail('Video stream fail ho gaya. Dubara try karein.', 502);
+    if (!$started) {
+        if ($status === 416) {
+            fail('Requested range available nahi hai.', 416);
+        }
+        if ($ok === false || $status >= 400) {
+            fail('Video stream fail ho gaya. Dubara try karein.', 502);
+        }
+        $sendHeaders();
     }
     exit;
 }
@@ -119,7 +171,13 @@ function extractFromOwnApi(string $videoUrl, string $apiUrl, string $apiToken):
         $fileName = 'reel_' . date('Ymd_His') . '.' . $ext;
     }
 
-    return [$mediaUrl, $fileName];
+    // Signed /download link (self_api); browser seedha wahin se resumable download karta hai.
+    $downloadUrl = (string)($data['download_url'] ?? '');
+    if (!filter_var($downloadUrl, FILTER_VALIDATE_URL)) {
+        $downloadUrl = '';
+    }
+
+    return [$mediaUrl, $fileName, $downloadUrl];
 }
 
 if ($_SERVER['REQUEST_METHOD'] !== 'POST') {
@@ -156,5 +214,11 @@ if ($apiToken === '' || $apiToken === 'CHANGE_ME_LONG_RANDOM_TOKEN') {
     fail('config.php me DOWNLOADER_API_TOKEN set karein.', 500);
 }
 
-[$mediaUrl, $fileName] = extractFromOwnApi($videoUrl, $apiUrl, $apiToken);
+[$mediaUrl, $fileName, $downloadUrl] = extractFromOwnApi($videoUrl, $apiUrl, $apiToken);
+// Normal form submit: browser ko API ke signed link par bhejo (Range/resume wahan hai).
+// AJAX blob path same-origin rehta hai, isliye wahan PHP hi stream karta hai.
+if ($downloadUrl !== '' && !isAjaxRequest()) {
+    header('Location: ' . $downloadUrl, true, 303);
+    exit;
+}
 streamRemoteFile($mediaUrl, $fileName);
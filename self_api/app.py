@@ -1,14 +1,180 @@
+import bisect
+import copy
+import hashlib
+import hmac
+import http.client
+import json
+import math
 import os
 import re
-from urllib.parse import urlparse
+import sqlite3
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import ExitStack, contextmanager
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, quote, urlencode, urljoin, urlparse, urlunparse
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from yt_dlp import YoutubeDL
+from yt_dlp.extractor.facebook import (
+    FacebookAdsIE,
+    FacebookIE,
+    FacebookPluginsVideoIE,
+    FacebookRedirectURLIE,
+    FacebookReelIE,
+)
+from yt_dlp.extractor.generic import GenericIE
+from yt_dlp.extractor.instagram import (
+    InstagramIE,
+    InstagramIOSIE,
+    InstagramStoryIE,
+    InstagramTagIE,
+    InstagramUserIE,
+)
 
 app = Flask(__name__)
 
 API_TOKEN = os.getenv("API_TOKEN", "")
 SUPPORTED_HOSTS = ("instagram.com", "facebook.com", "fb.watch")
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2048"))
+RESULT_CACHE_DEFAULT_TTL = int(os.getenv("RESULT_CACHE_DEFAULT_TTL", "300"))
+RESULT_CACHE_MAX_TTL = int(os.getenv("RESULT_CACHE_MAX_TTL", "21600"))
+# "memory" = har worker ka apna LRU; "sqlite" = host ke saare gunicorn workers ek file share karte hain.
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory").strip().lower()
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "/tmp/reel_result_cache.sqlite3")
+# Itne writes ke baad expired rows saaf karo aur size cap lagao.
+RESULT_CACHE_PURGE_EVERY = 256
+# Signed CDN URL expire hone se itne seconds pehle cache entry drop karo.
+CDN_EXPIRY_MARGIN = 120
+FAILURE_CACHE_SIZE = int(os.getenv("FAILURE_CACHE_SIZE", "1024"))
+# Private/deleted/rate-limited reels ka failure itni der replay karo, upstream ko dobara mat poochho.
+FAILURE_CACHE_TTLS = {
+    "rate_limited": int(os.getenv("FAILURE_TTL_RATE_LIMITED", "30")),
+    "login_required": int(os.getenv("FAILURE_TTL_LOGIN_REQUIRED", "300")),
+    "not_found": int(os.getenv("FAILURE_TTL_NOT_FOUND", "900")),
+}
+# Sirf asli 429 bucket ko dheema kare. yt-dlp ka "rate-limit reached or login
+# required" har private reel par bhi aata hai, isliye wo count nahi hota.
+RATE_LIMIT_PATTERNS = ("http error 429", "too many requests")
+FAILURE_PATTERNS = (
+    ("rate_limited", ("http error 429", "too many requests", "rate-limit", "rate limit")),
+    ("login_required", ("login required", "log in", "private", "checkpoint")),
+    (
+        "not_found",
+        (
+            "http error 404",
+            "http error 410",
+            "not found",
+            "does not exist",
+            "has been removed",
+            "isn't available",
+        ),
+    ),
+)
+# Poori request ka budget; download.php ka 60 s curl timeout isse upar rehna chahiye.
+REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET", "55"))
+YTDLP_SOCKET_TIMEOUT = 20.0
+# Itna budget bhi na bacha ho to naya attempt shuru mat karo.
+MIN_ATTEMPT_BUDGET = 1.0
+# Har option set ke liye itne warm YoutubeDL instances rakho (ADMISSION_MAX_INFLIGHT ke barabar).
+YTDLP_POOL_SIZE = int(os.getenv("YTDLP_POOL_SIZE", "4"))
+# Poori ~1800 extractor registry ki jagah sirf Instagram/Facebook extractors load karo.
+YTDLP_TRIMMED_EXTRACTORS = os.getenv(
+    "YTDLP_TRIMMED_EXTRACTORS", ""
+).strip().lower() in ("1", "true", "yes")
+# Registry wala order; GenericIE last, kyunki fb.watch aur /share/ links redirect
+# ke baad hi Facebook extractors tak pahunchte hain.
+TRIMMED_EXTRACTORS = (
+    FacebookAdsIE,
+    FacebookIE,
+    FacebookPluginsVideoIE,
+    FacebookRedirectURLIE,
+    FacebookReelIE,
+    InstagramIE,
+    InstagramIOSIE,
+    InstagramStoryIE,
+    InstagramTagIE,
+    InstagramUserIE,
+    GenericIE,
+)
+# Instagram/Facebook ki taraf har yt-dlp call ek token leti hai.
+UPSTREAM_RATE = float(os.getenv("UPSTREAM_RATE", "5"))
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", "10"))
+# Token ke liye itni der tak queue me ruko, phir fast-fail (503 + Retry-After).
+UPSTREAM_MAX_WAIT = float(os.getenv("UPSTREAM_MAX_WAIT", "10"))
+# 429 par rate aadha (is floor tak) aur upstream calls pause; lagatar 429 par pause double.
+UPSTREAM_MIN_RATE = 0.5
+UPSTREAM_MAX_BACKOFF = 60.0
+# "memory" = har worker ka apna bucket; "sqlite" = host ke saare workers ek bucket share karte hain.
+UPSTREAM_GOVERNOR_BACKEND = os.getenv("UPSTREAM_GOVERNOR_BACKEND", "memory").strip().lower()
+UPSTREAM_GOVERNOR_PATH = os.getenv("UPSTREAM_GOVERNOR_PATH", "/tmp/reel_upstream_governor.sqlite3")
+THROTTLED_MESSAGE = "upstream request budget khatam"
+# Ek worker me ek saath itni extractions; baaki queue me, queue bhari ho to turant 503.
+# gunicorn --threads isse zyada rakho, taaki excess requests app tak pahunch kar shed ho sakein.
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "4"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "8"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+# Hot reels (cache lifetime me itne hits) ko cache expiry se itne seconds pehle background me
+# dobara resolve karo, taaki popular content kabhi cold na ho.
+REFRESH_AHEAD_SECONDS = float(os.getenv("REFRESH_AHEAD_SECONDS", "120"))
+REFRESH_MIN_HITS = int(os.getenv("REFRESH_MIN_HITS", "3"))
+REFRESH_WORKERS = int(os.getenv("REFRESH_WORKERS", "2"))
+REFRESH_SCAN_INTERVAL = 15.0
+REFRESH_MAX_TRACKED = 2048
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", "50"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+# Ek batch kabhi saare admission slots na le, taaki single /extract callers starve na hon.
+BATCH_CONCURRENCY = max(1, min(BATCH_WORKERS, ADMISSION_MAX_INFLIGHT - 1))
+# all_media mode: ek post ki max entries, aur ek saath kitni resolve hon.
+CAROUSEL_MAX_ITEMS = int(os.getenv("CAROUSEL_MAX_ITEMS", "20"))
+CAROUSEL_WORKERS = int(os.getenv("CAROUSEL_WORKERS", "4"))
+# Instagram ke video_versions formats me size ya bitrate nahi hota; size resolution
+# aur duration se typical H.264 reel bitrate par estimate hota hai.
+VARIANT_BITS_PER_PIXEL = 0.1
+VARIANT_DEFAULT_FPS = 30
+# Download proxy sirf in CDN hosts ka media relay karta hai (open proxy nahi).
+MEDIA_HOSTS = ("cdninstagram.com", "fbcdn.net")
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# /extract har media URL ke saath ek signed /download link deta hai, taaki browser bina
+# API_TOKEN ke resumable download kar sake. Key na ho to API_TOKEN hi key hai.
+DOWNLOAD_SIGNING_KEY = os.getenv("DOWNLOAD_SIGNING_KEY", "") or os.getenv("API_TOKEN", "")
+DOWNLOAD_URL_TTL = int(os.getenv("DOWNLOAD_URL_TTL", "3600"))
+# Proxy ke peeche ho to public base URL (jaise https://api.example.com); warna request host.
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+DOWNLOAD_TIMEOUT = 30.0
+HTTP_POOL_MAX_PER_HOST = int(os.getenv("HTTP_POOL_MAX_PER_HOST", "16"))
+# Server idle keep-alive sockets drop kar dete hain; isse purane reuse mat karo.
+HTTP_POOL_IDLE_TIMEOUT = 30.0
+MAX_REDIRECTS = 5
+# Upstream se client tak copy hone wale headers.
+FORWARDED_REQUEST_HEADERS = ("Range", "If-Range")
+FORWARDED_RESPONSE_HEADERS = (
+    "Content-Type", "Content-Length", "Content-Range", "Accept-Ranges",
+    "ETag", "Last-Modified",
+)
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0
+)
+SHORTCODE_RE = re.compile(r"/(reel|reels|p)/([A-Za-z0-9_-]+)")
+# /reel/<id>, /<page>/videos/<id>/ aur /<page>/videos/<slug>/<id>/
+FACEBOOK_VIDEO_RE = re.compile(r"/(?:reel|videos)/(?:[^/]+/)*?(\d+)(?:/|$)")
+# fb.watch aur /share/ links bas asli post par redirect karte hain; target worker me
+# cache hota hai taaki redirect chain ek hi baar follow ho.
+SHORT_LINK_CACHE_SIZE = int(os.getenv("SHORT_LINK_CACHE_SIZE", "2048"))
+SHORT_LINK_TTL = int(os.getenv("SHORT_LINK_TTL", "86400"))
+SHORT_LINK_TIMEOUT = 10.0
+SHORT_LINK_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) "
+        "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 "
+        "Mobile/15E148 Safari/604.1"
+    ),
+    "Accept-Language": "en-US,en;q=0.9",
+}
 
 
 def error(message: str, status: int = 400):
@@ -32,60 +198,1643 @@ def sanitize_filename(title: str, ext: str) -> str:
     return f"{safe}.{ext}"
 
 
-@app.get("/health")
-def health():
-    return jsonify({"ok": True})
+def is_short_link(url: str) -> bool:
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if host == "fb.watch" or host.endswith(".fb.watch"):
+        return True
+    return (
+        ("facebook.com" in host or "instagram.com" in host)
+        and (parsed.path or "").startswith("/share/")
+    )
 
 
-@app.post("/extract")
-def extract():
-    auth = request.headers.get("Authorization", "")
-    expected = f"Bearer {API_TOKEN}"
-    if not API_TOKEN:
-        return error("API_TOKEN server par set nahi hai.", 500)
-    if auth != expected:
-        return error("Unauthorized", 401)
+def short_link_key(url: str) -> str:
+    # Share links ka query sirf tracking hai (igsh=, mibextid=).
+    parsed = urlparse(url)
+    return urlunparse(("https", (parsed.hostname or "").lower(), parsed.path, "", "", ""))
 
-    payload = request.get_json(silent=True) or {}
-    url = str(payload.get("url", "")).strip()
 
-    if not url:
-        return error("URL required hai.", 400)
-    if not is_supported_url(url):
-        return error("Sirf Instagram/Facebook URLs supported hain.", 400)
+def media_key(url: str) -> str | None:
+    # "instagram:<shortcode>" / "facebook:<video id>"; short/share link ya koi aur
+    # URL jo media ko naam se nahi batata, uske liye None.
+    if is_short_link(url):
+        return None
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+
+    # /reel/, /reels/ aur /p/ -- ek shortcode ka media ek hi hota hai.
+    if "instagram.com" in host:
+        match = SHORTCODE_RE.search(parsed.path or "")
+        if match:
+            return f"instagram:{match.group(2)}"
+
+    # watch/?v=, video.php?v=, /reel/<id> aur /videos/<id> -- sab ek hi video.
+    if "facebook.com" in host:
+        video_id = (parse_qs(parsed.query).get("v") or [""])[0]
+        if video_id.isdigit():
+            return f"facebook:{video_id}"
+        match = FACEBOOK_VIDEO_RE.search(parsed.path or "")
+        if match:
+            return f"facebook:{match.group(1)}"
+    return None
+
+
+def canonical_key(url: str) -> str:
+    key = media_key(url)
+    if key:
+        return key
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    return urlunparse(("https", host, parsed.path.rstrip("/"), "", parsed.query, ""))
+
+
+def cache_ttl_for(media_url: str) -> int:
+    # Instagram/Facebook CDN URLs me signed expiry `oe` param me hex epoch hoti hai.
+    values = parse_qs(urlparse(media_url).query).get("oe")
+    if not values:
+        return RESULT_CACHE_DEFAULT_TTL
+    try:
+        expires = int(values[0], 16)
+    except ValueError:
+        return RESULT_CACHE_DEFAULT_TTL
+    ttl = expires - int(time.time()) - CDN_EXPIRY_MARGIN
+    return max(0, min(ttl, RESULT_CACHE_MAX_TTL))
+
+
+def classify_failure(messages: list[str]) -> str | None:
+    combined = " | ".join(messages).lower()
+    matched = [
+        reason
+        for reason, needles in FAILURE_PATTERNS
+        if any(needle in combined for needle in needles)
+    ]
+    # yt-dlp ka "rate-limit reached or login required" do types match karta hai;
+    # sabse chhota TTL jeetega taaki temporary limit reel ko der tak block na kare.
+    return min(matched, key=FAILURE_CACHE_TTLS.get, default=None)
+
+
+def is_rate_limited(message: str) -> bool:
+    message = message.lower()
+    return any(needle in message for needle in RATE_LIMIT_PATTERNS)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget: float) -> None:
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() < MIN_ATTEMPT_BUDGET
+
+    def timeout(self, cap: float) -> float:
+        if self.expired():
+            raise DeadlineExceeded("request budget khatam")
+        return min(cap, self.remaining())
+
+
+class ResultCache:
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: dict, ttl: int) -> None:
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def thread_sqlite(local: threading.local, path: str) -> sqlite3.Connection:
+    # Har thread (aur fork ke baad har process) ka apna WAL mode connection.
+    conn = getattr(local, "conn", None)
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(path, timeout=1.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
+
+
+class SqliteResultCache:
+    # WAL mode SQLite file: readers writers ko block nahi karte, aur point lookup
+    # primary key par sub-millisecond hai.
+    def __init__(self, path: str, max_entries: int) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return thread_sqlite(self._local, self.path)
+
+    def get(self, key: str) -> dict | None:
+        try:
+            row = self._connect().execute(
+                "SELECT value FROM results WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict, ttl: int) -> None:
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+            )
+            self._writes += 1
+            if self._writes % RESULT_CACHE_PURGE_EVERY == 0:
+                self._purge(conn)
+        except sqlite3.Error:
+            pass
+
+    def _purge(self, conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+        # Sabse pehle expire hone wali entries hata kar size cap ke andar raho.
+        conn.execute(
+            "DELETE FROM results WHERE key IN ("
+            "SELECT key FROM results ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def __len__(self) -> int:
+        try:
+            return self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+
+def make_result_cache():
+    if RESULT_CACHE_BACKEND == "sqlite":
+        return SqliteResultCache(RESULT_CACHE_PATH, RESULT_CACHE_SIZE)
+    return ResultCache(RESULT_CACHE_SIZE)
+
+
+RESULT_CACHE = make_result_cache()
+FAILURE_CACHE = ResultCache(FAILURE_CACHE_SIZE)
+SHORT_LINK_CACHE = ResultCache(SHORT_LINK_CACHE_SIZE)
+
+
+class UpstreamThrottled(Exception):
+    pass
+
+
+class RateGovernor:
+    # Token bucket + AIMD: caller token reserve karta hai (future ka token bhi, yani
+    # queue me wait), 429 rate ghata kar badhta hua pause lagata hai, aur success
+    # rate ko dheere dheere wapas laata hai.
+    def __init__(self, rate: float, burst: float, max_wait: float) -> None:
+        self.base_rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.granted = 0
+        self.shed = 0
+        self.throttled = 0
+        self._state = {
+            "tokens": burst,
+            "updated": time.time(),
+            "rate": rate,
+            "backoff": 0.0,
+            "blocked_until": 0.0,
+        }
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            yield self._state
+
+    def reserve(self, max_wait: float) -> float | None:
+        with self._transaction() as state:
+            now = time.time()
+            elapsed = max(0.0, now - state["updated"])
+            state["tokens"] = min(self.burst, state["tokens"] + elapsed * state["rate"])
+            state["updated"] = now
+            wait = max(
+                state["blocked_until"] - now,
+                (1 - state["tokens"]) / state["rate"],
+                0.0,
+            )
+            if wait > max_wait:
+                self.shed += 1
+                return None
+            state["tokens"] -= 1
+            self.granted += 1
+            return wait
+
+    def wait_budget(self, deadline: Deadline | None) -> float:
+        if deadline is None:
+            return self.max_wait
+        return min(self.max_wait, deadline.remaining() - MIN_ATTEMPT_BUDGET)
+
+    def acquire(self, deadline: Deadline | None = None) -> None:
+        wait = self.reserve(self.wait_budget(deadline))
+        if wait is None:
+            raise UpstreamThrottled(THROTTLED_MESSAGE)
+        if wait:
+            time.sleep(wait)
+
+    def penalize(self) -> None:
+        with self._transaction() as state:
+            now = time.time()
+            # Pehle se in-flight requests usi episode ka 429 laati hain; ek hi baar gino.
+            if state["blocked_until"] > now:
+                return
+            state["rate"] = max(UPSTREAM_MIN_RATE, state["rate"] / 2)
+            state["backoff"] = min(UPSTREAM_MAX_BACKOFF, max(1.0, state["backoff"] * 2))
+            state["blocked_until"] = now + state["backoff"]
+            self.throttled += 1
+
+    def reward(self) -> None:
+        with self._transaction() as state:
+            state["rate"] = min(self.base_rate, state["rate"] + self.base_rate / 10)
+            state["backoff"] = 0.0
+
+    def feedback(self, exc: Exception | None) -> None:
+        if exc is None:
+            self.reward()
+        elif is_rate_limited(str(exc)):
+            self.penalize()
+
+    @contextmanager
+    def slot(self, deadline: Deadline | None = None):
+        self.acquire(deadline)
+        try:
+            yield
+        except Exception as exc:
+            self.feedback(exc)
+            raise
+        self.feedback(None)
+
+    def retry_after(self) -> int:
+        with self._transaction() as state:
+            paused = state["blocked_until"] - time.time()
+            queued = (1 - state["tokens"]) / state["rate"]
+        return max(1, math.ceil(max(paused, queued - self.max_wait)))
+
+    def stats(self) -> dict:
+        with self._transaction() as state:
+            rate = state["rate"]
+            paused = max(0.0, state["blocked_until"] - time.time())
+        return {
+            "rate": round(rate, 3),
+            "paused_seconds": round(paused, 3),
+            "granted": self.granted,
+            "shed": self.shed,
+            "throttled": self.throttled,
+        }
+
+
+class SqliteRateGovernor(RateGovernor):
+    # Bucket state ek SQLite row me; BEGIN IMMEDIATE se saare workers ke
+    # read-modify-write serialize hote hain. Counters har process ke apne hain.
+    # File lock na mile (busy timeout) ya koi aur sqlite error aaye to fail open:
+    # us call ke liye process ka apna in-memory bucket (aakhri dekhi state) chalta hai.
+    def __init__(self, path: str, rate: float, burst: float, max_wait: float) -> None:
+        super().__init__(rate, burst, max_wait)
+        self.path = path
+        self.sqlite_errors = 0
+        self._local = threading.local()
+        thread_sqlite(self._local, path).execute(
+            "CREATE TABLE IF NOT EXISTS governor (name TEXT PRIMARY KEY, state TEXT NOT NULL)"
+        )
+
+    @staticmethod
+    def _rollback(conn: sqlite3.Connection | None) -> None:
+        if conn is None:
+            return
+        try:
+            conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def _transaction(self):
+        conn = None
+        try:
+            conn = thread_sqlite(self._local, self.path)
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT state FROM governor WHERE name = 'upstream'"
+            ).fetchone()
+        except sqlite3.Error:
+            self.sqlite_errors += 1
+            self._rollback(conn)
+            with super()._transaction() as state:
+                yield state
+            return
+
+        state = json.loads(row[0]) if row else dict(self._state)
+        try:
+            yield state
+        except BaseException:
+            self._rollback(conn)
+            raise
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO governor (name, state) VALUES ('upstream', ?)",
+                (json.dumps(state),),
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            self.sqlite_errors += 1
+            self._rollback(conn)
+        with self._lock:
+            self._state.update(state)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "sqlite_errors": self.sqlite_errors}
 
-    ydl_opts = {
+
+def make_governor() -> RateGovernor:
+    if UPSTREAM_GOVERNOR_BACKEND == "sqlite":
+        return SqliteRateGovernor(
+            UPSTREAM_GOVERNOR_PATH, UPSTREAM_RATE, UPSTREAM_BURST, UPSTREAM_MAX_WAIT
+        )
+    return RateGovernor(UPSTREAM_RATE, UPSTREAM_BURST, UPSTREAM_MAX_WAIT)
+
+
+UPSTREAM = make_governor()
+
+
+class Metrics:
+    # Chhota Prometheus-style registry. Har observation ek lock ke andar dict lookup,
+    # bisect aur do additions hai -- network call ke saamne negligible.
+    def __init__(self) -> None:
+        self._counters: dict[tuple, float] = {}
+        self._histograms: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                # Har bucket ka count, phir +Inf, sum aur count.
+                series = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+            series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _labels(pairs, extra: str = "") -> str:
+        parts = [f'{k}="{v}"' for k, v in pairs]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self, gauges: dict[str, float]) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(series) for key, series in self._histograms.items()}
+
+        lines: list[str] = []
+        typed: set[str] = set()
+        for (name, pairs), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._labels(pairs)} {value:g}")
+        for (name, pairs), series in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{self._labels(pairs, le)} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(pairs)} {series[-2]:.6f}")
+            lines.append(f"{name}_count{self._labels(pairs)} {series[-1]}")
+        for name, value in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    # Ek key ke liye ek hi extraction chale; baaki callers wahi result share karein.
+    def __init__(self) -> None:
+        self.leaders = 0
+        self.coalesced = 0
+        self._flights: dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn, timeout: float | None = None):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise DeadlineExceeded("coalesced extraction ka wait timeout")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._flights)
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+        }
+
+
+INFLIGHT = SingleFlight()
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionGate:
+    # Bounded FIFO-ish queue: max_inflight extractions chalti hain, max_queue wait karti
+    # hain (max_wait tak), aur baaki turant shed. Admitted requests ki latency predictable rehti hai.
+    def __init__(self, max_inflight: int, max_queue: int, max_wait: float) -> None:
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.inflight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self._cond = threading.Condition()
+
+    def _enter(self, max_wait: float) -> None:
+        with self._cond:
+            if self.inflight >= self.max_inflight or self.waiting:
+                if self.waiting >= self.max_queue or max_wait <= 0:
+                    self.shed += 1
+                    raise Overloaded("admission queue full")
+                self.waiting += 1
+                expires_at = time.monotonic() + max_wait
+                try:
+                    while self.inflight >= self.max_inflight:
+                        remaining = expires_at - time.monotonic()
+                        if remaining <= 0:
+                            self.shed += 1
+                            raise Overloaded("admission queue wait timeout")
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.inflight += 1
+            self.admitted += 1
+
+    def try_enter(self) -> bool:
+        # Background kaam ke liye: slot khali ho to lo, warna bina queue/shed ke False.
+        with self._cond:
+            if self.inflight >= self.max_inflight or self.waiting:
+                return False
+            self.inflight += 1
+            self.admitted += 1
+            return True
+
+    def _exit(self) -> None:
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self, deadline: Deadline):
+        started = time.perf_counter()
+        self._enter(min(self.max_wait, deadline.remaining() - MIN_ATTEMPT_BUDGET))
+        METRICS.observe("extract_admission_wait_seconds", time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "inflight": self.inflight,
+                "queued": self.waiting,
+                "admitted": self.admitted,
+                "shed": self.shed,
+            }
+
+
+ADMISSION = AdmissionGate(ADMISSION_MAX_INFLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT)
+
+
+def pooled_timeout(seconds: float) -> float:
+    # Deadline se nikle timeouts ko buckets me round karo taaki pool entries share ho sakein.
+    if seconds >= 5:
+        return float(math.floor(seconds / 5) * 5)
+    return float(max(1, math.floor(seconds)))
+
+
+def build_ydl_opts(socket_timeout: float, noplaylist: bool = True) -> dict:
+    return {
         "quiet": True,
         "no_warnings": True,
         "skip_download": True,
         "nocheckcertificate": False,
-        "noplaylist": True,
+        "noplaylist": noplaylist,
+        "socket_timeout": pooled_timeout(socket_timeout),
+    }
+
+
+def new_youtubedl(ydl_opts: dict) -> YoutubeDL:
+    if not YTDLP_TRIMMED_EXTRACTORS:
+        return YoutubeDL(ydl_opts)
+    ydl = YoutubeDL(ydl_opts, auto_init=False)
+    for extractor in TRIMMED_EXTRACTORS:
+        ydl.add_info_extractor(extractor())
+    return ydl
+
+
+class YoutubeDLPool:
+    # YoutubeDL banana extractor registry, cookie jar aur HTTP handlers load karta hai,
+    # isliye warm instances reuse hote hain. Ek instance ek time par ek hi thread ke paas.
+    def __init__(self, max_idle: int) -> None:
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._idle: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(ydl_opts: dict) -> str:
+        return json.dumps(ydl_opts, sort_keys=True, default=repr)
+
+    @staticmethod
+    def _build(ydl_opts: dict):
+        # YoutubeDL apna params dict in place bharta hai (compat_opts, outtmpl, ...);
+        # copy se build karo taaki caller ke opts aur pool key na badlein.
+        return new_youtubedl(copy.deepcopy(ydl_opts))
+
+    def _acquire(self, key: str, ydl_opts: dict):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.created += 1
+        return self._build(ydl_opts)
+
+    def _release(self, key: str, ydl) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(ydl)
+                return
+        ydl.close()
+
+    @contextmanager
+    def borrow(self, ydl_opts: dict):
+        key = self.key_for(ydl_opts)
+        ydl = self._acquire(key, ydl_opts)
+        try:
+            yield ydl
+        finally:
+            self._release(key, ydl)
+
+    def prewarm(self, ydl_opts: dict, count: int) -> None:
+        key = self.key_for(ydl_opts)
+        built = [self._build(ydl_opts) for _ in range(count)]
+        with self._lock:
+            self.created += len(built)
+        for ydl in built:
+            self._release(key, ydl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+        return {"created": self.created, "reused": self.reused, "idle": idle}
+
+
+YTDLP_POOL = YoutubeDLPool(YTDLP_POOL_SIZE)
+# Worker start par hi common option set ke instances bana lo.
+YTDLP_POOL.prewarm(build_ydl_opts(YTDLP_SOCKET_TIMEOUT), YTDLP_POOL_SIZE)
+
+
+class RedirectNotAllowed(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Warm worker me requests ke beech share hone wale keep-alive HTTP(S) connections,
+    # har origin par max_per_host tak. Body poori padhi gayi ho tabhi connection
+    # wapas pool me jata hai.
+    def __init__(self, max_per_host: int) -> None:
+        self.max_per_host = max_per_host
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self._ssl_context = ssl.create_default_context()
+        self._idle: dict[tuple, list] = {}
+        self._slots: dict[tuple, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _checkout(self, origin: tuple, timeout: float):
+        with self._lock:
+            slot = self._slots.get(origin)
+            if slot is None:
+                slot = self._slots[origin] = threading.BoundedSemaphore(
+                    self.max_per_host
+                )
+        if not slot.acquire(timeout=timeout):
+            raise TimeoutError(f"no free connection to {origin[1]}")
+
+        with self._lock:
+            idle = self._idle.get(origin, [])
+            while idle:
+                conn, idle_since = idle.pop()
+                if time.monotonic() - idle_since < HTTP_POOL_IDLE_TIMEOUT:
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+            self.created += 1
+
+        scheme, host, port = origin
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=timeout, context=self._ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        return conn, False
+
+    def _checkin(self, origin: tuple, conn, reusable: bool) -> None:
+        with self._lock:
+            if reusable:
+                self._idle.setdefault(origin, []).append((conn, time.monotonic()))
+            else:
+                self.discarded += 1
+        if not reusable:
+            conn.close()
+        self._slots[origin].release()
+
+    def _send(self, origin: tuple, target: str, headers: dict, timeout: float):
+        conn, reused = self._checkout(origin, timeout)
+        try:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            conn.request("GET", target, headers=headers)
+            return conn, conn.getresponse()
+        except Exception as exc:
+            self._checkin(origin, conn, False)
+            # Idle pada pooled socket server ne band kar diya ho sakta hai.
+            if reused and isinstance(
+                exc, (http.client.RemoteDisconnected, ConnectionError)
+            ):
+                return self._send(origin, target, headers, timeout)
+            raise
+
+    def _follow(self, url: str, headers: dict, timeout: float, stop=None, allow=None):
+        # Redirects follow karo jab tak non-redirect response na mile, ya stop(url) bole
+        # ki target kaafi hai; us case me kuch open nahi rehta. allow(url) har hop par
+        # check hota hai, fail ho to RedirectNotAllowed.
+        redirects = 0
+        while True:
+            parsed = urlparse(url)
+            scheme = parsed.scheme.lower()
+            default_port = 443 if scheme == "https" else 80
+            origin = (scheme, parsed.hostname, parsed.port or default_port)
+            target = urlunparse(
+                ("", "", parsed.path or "/", parsed.params, parsed.query, "")
+            )
+            conn, response = self._send(origin, target, headers, timeout)
+
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                self._checkin(origin, conn, not response.will_close)
+                redirects += 1
+                if redirects > MAX_REDIRECTS:
+                    raise HTTPError(
+                        url, response.status, "Too many redirects", response.headers, None
+                    )
+                url = urljoin(url, location)
+                if allow is not None and not allow(url):
+                    raise RedirectNotAllowed(url)
+                if stop is not None and stop(url):
+                    return url, None, None, None
+                continue
+            if response.status >= 400:
+                self._checkin(origin, conn, False)
+                raise HTTPError(
+                    url, response.status, response.reason, response.headers, None
+                )
+            return url, origin, conn, response
+
+    @contextmanager
+    def open(self, url: str, headers: dict, timeout: float, allow=None):
+        _, origin, conn, response = self._follow(url, headers, timeout, allow=allow)
+        try:
+            yield response
+        finally:
+            self._checkin(
+                origin, conn, response.isclosed() and not response.will_close
+            )
+
+    def resolve_redirects(self, url: str, headers: dict, timeout: float, stop=None) -> str:
+        # Redirect chain ka final URL; aakhri page ki body kabhi read nahi hoti.
+        url, origin, conn, response = self._follow(url, headers, timeout, stop)
+        if response is not None:
+            self._checkin(origin, conn, False)
+        return url
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded,
+            "idle": idle,
+        }
+
+
+HTTP_POOL = ConnectionPool(HTTP_POOL_MAX_PER_HOST)
+
+
+def expand_short_link(url: str, deadline: Deadline) -> str:
+    # Short/share link -> jis post par redirect hota hai; pehle hop par ruk jao jo
+    # media ko naam se bata de. Fail ho to link waisa hi lautao, yt-dlp khud follow karega.
+    if not is_short_link(url):
+        return url
+    cache_key = short_link_key(url)
+    cached = SHORT_LINK_CACHE.get(cache_key)
+    if cached is not None:
+        METRICS.inc("extract_short_links_total", outcome="cached")
+        return cached["url"]
+
+    def follow() -> str:
+        with METRICS.timer("extract_stage_seconds", stage="redirect"), UPSTREAM.slot(deadline):
+            return HTTP_POOL.resolve_redirects(
+                url,
+                SHORT_LINK_HEADERS,
+                deadline.timeout(SHORT_LINK_TIMEOUT),
+                stop=lambda u: media_key(u) is not None,
+            )
+
+    try:
+        # Same link par concurrent requests ek hi redirect fetch share karti hain.
+        target = INFLIGHT.do(f"short:{cache_key}", follow, deadline.remaining())
+    except Exception:
+        METRICS.inc("extract_short_links_total", outcome="error")
+        return url
+    # Chain kahin aur khatam ho (login page, consent wall) to cache mat karo;
+    # yt-dlp ko original link do, wo khud follow karega.
+    if media_key(target) is None:
+        METRICS.inc("extract_short_links_total", outcome="unresolved")
+        return url
+    METRICS.inc("extract_short_links_total", outcome="resolved")
+    SHORT_LINK_CACHE.set(cache_key, {"url": target}, SHORT_LINK_TTL)
+    return target
+
+
+def download_signature(media_url: str, filename: str, expires: int) -> str:
+    message = f"{media_url}\n{filename}\n{expires}".encode("utf-8")
+    return hmac.new(DOWNLOAD_SIGNING_KEY.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def with_download_urls(result: dict, base_url: str) -> dict:
+    # Har response par naya banta hai (cache me nahi jaata), kyunki expiry request time se chalti hai.
+    if "items" in result:
+        result = {**result, "items": [with_download_urls(i, base_url) for i in result["items"]]}
+    if not DOWNLOAD_SIGNING_KEY or not is_media_url(result.get("media_url", "")):
+        return result
+    expires = int(time.time()) + DOWNLOAD_URL_TTL
+    query = urlencode({
+        "u": result["media_url"],
+        "fn": result["filename"],
+        "exp": expires,
+        "sig": download_signature(result["media_url"], result["filename"], expires),
+    })
+    return {**result, "download_url": f"{base_url}/download?{query}"}
+
+
+def public_base_url() -> str:
+    return PUBLIC_BASE_URL or request.host_url.rstrip("/")
+
+
+def is_media_url(url: str) -> bool:
+    try:
+        parsed = urlparse(url)
+    except Exception:
+        return False
+    host = (parsed.hostname or "").lower()
+    return parsed.scheme == "https" and any(
+        host == h or host.endswith("." + h) for h in MEDIA_HOSTS
+    )
+
+
+def timed_out() -> tuple[int, dict]:
+    return 504, {"error": "Extract me zyada time lag gaya. Thodi der baad try karein."}
+
+
+def overloaded() -> tuple[int, dict]:
+    return 503, {
+        "error": "Server abhi busy hai. Thodi der baad try karein.",
+        "retry_after": ADMISSION_RETRY_AFTER,
+    }
+
+
+def throttled() -> tuple[int, dict]:
+    # Request upstream tak gayi hi nahi, isliye failure cache nahi hota.
+    return 503, {
+        "error": "Instagram abhi rate-limit kar raha hai. Thodi der baad try karein.",
+        "retry_after": UPSTREAM.retry_after(),
     }
 
+
+def rank_variants(info: dict) -> list[dict]:
+    # Sirf progressive (audio+video ek file, seedha downloadable) renditions, best pehle.
+    # DASH/HLS tukde merge karne padte hain, download.php se stream nahi ho sakte.
+    duration = info.get("duration")
+    variants: list[dict] = []
+    seen: set[str] = set()
+    for fmt in info.get("formats") or []:
+        url = fmt.get("url")
+        if not isinstance(url, str) or not url.startswith("http") or url in seen:
+            continue
+        if fmt.get("vcodec") == "none" or fmt.get("acodec") == "none":
+            continue
+        if fmt.get("protocol") not in (None, "http", "https"):
+            continue
+        tbr = fmt.get("tbr")
+        size = fmt.get("filesize") or fmt.get("filesize_approx")
+        if not size and tbr and duration:
+            size = tbr * 1000 / 8 * duration
+        if not size and duration and fmt.get("width") and fmt.get("height"):
+            fps = fmt.get("fps") or VARIANT_DEFAULT_FPS
+            size = fmt["width"] * fmt["height"] * fps * VARIANT_BITS_PER_PIXEL / 8 * duration
+        seen.add(url)
+        variants.append({
+            "url": url,
+            "format_id": str(fmt.get("format_id") or ""),
+            "ext": str(fmt.get("ext") or "mp4"),
+            "width": fmt.get("width"),
+            "height": fmt.get("height"),
+            "bitrate_kbps": round(tbr) if tbr else None,
+            "estimated_bytes": int(size) if size else None,
+        })
+    variants.sort(
+        key=lambda v: (v["height"] or 0, v["bitrate_kbps"] or 0, v["estimated_bytes"] or 0),
+        reverse=True,
+    )
+    return variants
+
+
+def is_truthy(value) -> bool:
+    return value is True or str(value).strip().lower() in ("1", "true", "yes")
+
+
+def parse_limits(payload: dict) -> tuple[int | None, int | None]:
+    limits = []
+    for name in ("max_height", "max_bytes"):
+        value = payload.get(name)
+        if value is None or value == "":
+            limits.append(None)
+            continue
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            number = 0
+        if number <= 0:
+            raise ValueError(f"{name} positive integer hona chahiye.")
+        limits.append(number)
+    return limits[0], limits[1]
+
+
+def select_variant(result: dict, max_height: int | None, max_bytes: int | None) -> dict:
+    # Limits ke andar sabse achha variant; koi fit na ho to sabse chhota.
+    # Cache me saare variants rehte hain, isliye ye har request par cache ke baad chalta hai.
+    if "items" in result:
+        items = [select_variant(item, max_height, max_bytes) for item in result["items"]]
+        return {**result, "items": items}
+    variants = result.get("variants")
+    # Kisi variant ka size pata na ho to byte limit judge nahi ho sakti; smallest
+    # variant par girne ki jagah use ignore karo.
+    if variants and not any(variant["estimated_bytes"] for variant in variants):
+        max_bytes = None
+    if not variants or (max_height is None and max_bytes is None):
+        return result
+
+    def fits(variant: dict) -> bool:
+        if max_height is not None and (variant["height"] or 0) > max_height:
+            return False
+        if max_bytes is not None and (
+            variant["estimated_bytes"] is None or variant["estimated_bytes"] > max_bytes
+        ):
+            return False
+        return True
+
+    fitting = [variant for variant in variants if fits(variant)]
+    if fitting:
+        chosen = fitting[0]
+    else:
+        chosen = min(
+            variants,
+            key=lambda v: (v["estimated_bytes"] or math.inf, v["height"] or 0),
+        )
+    stem = result["filename"].rsplit(".", 1)[0]
+    return {
+        **result,
+        "media_url": chosen["url"],
+        "filename": f"{stem}.{chosen['ext']}",
+        "format_id": chosen["format_id"],
+    }
+
+
+def extract_media(url: str, deadline: Deadline) -> tuple[int, dict]:
     try:
-        with YoutubeDL(ydl_opts) as ydl:
+        socket_timeout = deadline.timeout(YTDLP_SOCKET_TIMEOUT)
+    except DeadlineExceeded:
+        return timed_out()
+
+    started = time.perf_counter()
+    try:
+        with UPSTREAM.slot(deadline), YTDLP_POOL.borrow(build_ydl_opts(socket_timeout)) as ydl:
             info = ydl.extract_info(url, download=False)
-    except Exception:
-        return error("Video extract fail ho gaya. Reel private ya unavailable ho sakti hai.", 422)
+    except UpstreamThrottled:
+        return throttled()
+    except Exception as exc:
+        METRICS.observe(
+            "extract_attempt_seconds", time.perf_counter() - started,
+            strategy="yt-dlp", outcome="error",
+        )
+        if deadline.expired():
+            return timed_out()
+        result = {"error": "Video extract fail ho gaya. Reel private ya unavailable ho sakti hai."}
+        reason = classify_failure([str(exc)])
+        if reason:
+            result["reason"] = reason
+        return 422, result
+    METRICS.observe(
+        "extract_attempt_seconds", time.perf_counter() - started,
+        strategy="yt-dlp", outcome="ok",
+    )
 
     if not isinstance(info, dict):
-        return error("Extractor response invalid hai.", 422)
+        return 422, {"error": "Extractor response invalid hai."}
 
     media_url = info.get("url")
     if not isinstance(media_url, str) or not media_url.startswith("http"):
-        return error("Downloadable media URL nahi mila.", 422)
+        return 422, {"error": "Downloadable media URL nahi mila."}
 
     title = str(info.get("title") or "reel")
     ext = str(info.get("ext") or "mp4")
     filename = sanitize_filename(title, ext)
 
+    result = {"media_url": media_url, "filename": filename}
+    variants = rank_variants(info)
+    if variants:
+        result["variants"] = variants
+    return 200, result
+
+
+def has_media_url(info) -> bool:
+    if not isinstance(info, dict):
+        return False
+    media_url = info.get("url")
+    return isinstance(media_url, str) and media_url.startswith("http")
+
+
+def entry_payload(entry: dict, title: str) -> dict | None:
+    # Carousel entries extract ho kar aati hain par format select nahi hota, isliye
+    # best progressive variant yt-dlp ke pick ki jagah; photo entries me sirf images.
+    variants = rank_variants(entry)
+    if has_media_url(entry):
+        result = {"type": "video", "media_url": entry["url"]}
+        ext = str(entry.get("ext") or "mp4")
+    elif variants:
+        result = {"type": "video", "media_url": variants[0]["url"]}
+        ext = variants[0]["ext"]
+    else:
+        images = [
+            thumb for thumb in entry.get("thumbnails") or []
+            if str(thumb.get("url") or "").startswith("http")
+        ]
+        if not images:
+            return None
+        best = max(images, key=lambda t: (t.get("width") or 0) * (t.get("height") or 0))
+        result = {"type": "image", "media_url": best["url"]}
+        path = urlparse(best["url"]).path
+        ext = path.rsplit(".", 1)[-1].lower() if "." in path else "jpg"
+    result["filename"] = sanitize_filename(title, ext)
+    if variants:
+        result["variants"] = variants
+    return result
+
+
+def extract_all_media(url: str, deadline: Deadline) -> tuple[int, dict]:
+    # Carousel/multi-video post ki saari entries. Jo extractor finished entries ki
+    # jagah references deta hai, unhe CAROUSEL_WORKERS ke saath concurrently resolve karo.
+    def extract(target: str, process: bool) -> dict:
+        socket_timeout = deadline.timeout(YTDLP_SOCKET_TIMEOUT)
+        ydl_opts = build_ydl_opts(socket_timeout, noplaylist=False)
+        with UPSTREAM.slot(deadline), YTDLP_POOL.borrow(ydl_opts) as ydl:
+            return ydl.extract_info(target, download=False, process=process)
+
+    try:
+        info = extract(url, False)
+    except DeadlineExceeded:
+        return timed_out()
+    except UpstreamThrottled:
+        return throttled()
+    except Exception as exc:
+        if deadline.expired():
+            return timed_out()
+        result = {"error": "Post extract fail ho gaya. Post private ya unavailable ho sakti hai."}
+        reason = classify_failure([str(exc)])
+        if reason:
+            result["reason"] = reason
+        return 422, result
+
+    entries = [info]
+    if info.get("_type") in ("playlist", "multi_video"):
+        entries = [e for e in info.get("entries") or [] if isinstance(e, dict)]
+    entries = entries[:CAROUSEL_MAX_ITEMS]
+    title = str(info.get("title") or "post")
+
+    items: list[dict | None] = [None] * len(entries)
+    references = {}
+    for index, entry in enumerate(entries):
+        name = f"{title}_{index + 1}" if len(entries) > 1 else title
+        if entry.get("_type") in ("url", "url_transparent"):
+            references[index] = name
+        else:
+            items[index] = entry_payload(entry, name)
+
+    if references:
+        executor = ThreadPoolExecutor(max_workers=CAROUSEL_WORKERS)
+        try:
+            futures = {
+                executor.submit(extract, entries[index]["url"], True): index
+                for index in references
+            }
+            done, _ = wait(futures, timeout=deadline.remaining())
+            for future in done:
+                index = futures[future]
+                try:
+                    items[index] = entry_payload(future.result(), references[index])
+                except Exception:
+                    items[index] = {"error": "Ye item extract nahi ho paya."}
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    items = [item or {"error": "Downloadable media nahi mila."} for item in items]
+    resolved = [item for item in items if "media_url" in item]
+    if not resolved:
+        return 422, {"error": "Is post me downloadable media nahi mila."}
+    return 200, {
+        "media_url": resolved[0]["media_url"],
+        "filename": resolved[0]["filename"],
+        "items": items,
+    }
+
+
+def result_ttl(result: dict) -> int:
+    urls = [item["media_url"] for item in result.get("items", []) if "media_url" in item]
+    return min(cache_ttl_for(media_url) for media_url in urls or [result["media_url"]])
+
+
+def cached_response(key: str) -> tuple[int, dict] | None:
+    cached = RESULT_CACHE.get(key)
+    if cached is not None:
+        REFRESHER.touch(key)
+        return 200, cached
+    failure = FAILURE_CACHE.get(key)
+    if failure is not None:
+        METRICS.inc("extract_failure_cache_hits_total", reason=failure["reason"])
+        return 422, failure
+    return None
+
+
+def remember(
+    key: str, status: int, result: dict, url: str = "", all_media: bool = False
+) -> None:
+    if status == 200:
+        ttl = result_ttl(result)
+        RESULT_CACHE.set(key, result, ttl)
+        if url:
+            REFRESHER.track(key, url, all_media, ttl)
+    elif status == 422 and "reason" in result:
+        FAILURE_CACHE.set(key, result, FAILURE_CACHE_TTLS[result["reason"]])
+
+
+def lookup_key(url: str, all_media: bool = False) -> str:
+    return canonical_key(url) + ("#all" if all_media else "")
+
+
+def resolve(
+    url: str, key: str, deadline: Deadline, all_media: bool = False
+) -> tuple[int, dict]:
+    # Leader ke aane tak koi aur flight result cache kar chuki ho sakti hai.
+    cached = cached_response(key)
+    if cached is not None:
+        return cached
+
+    # Sirf cache miss ka leader slot leta hai; cache hits aur coalesced followers gate ke bahar.
+    try:
+        with ADMISSION.admit(deadline), METRICS.timer("extract_stage_seconds", stage="extract"):
+            if all_media:
+                status, result = extract_all_media(url, deadline)
+            else:
+                status, result = extract_media(url, deadline)
+    except Overloaded:
+        return overloaded()
+    remember(key, status, result, url, all_media)
+    return status, result
+
+
+def refresh_entry(key: str, url: str, all_media: bool) -> int | None:
+    # Live requests usi key par aayein to isi flight se jud jaati hain. Gate bhara ho
+    # to refresh skip (None); entry normal tarah expire hogi aur live request resolve karegi.
+    if not ADMISSION.try_enter():
+        return None
+    deadline = Deadline(REQUEST_BUDGET)
+
+    def run() -> tuple[int, dict]:
+        extractor = extract_all_media if all_media else extract_media
+        status, result = extractor(url, deadline)
+        remember(key, status, result, url, all_media)
+        return status, result
+
+    try:
+        status, _ = INFLIGHT.do(key, run, deadline.remaining())
+    except DeadlineExceeded:
+        return 504
+    finally:
+        ADMISSION._exit()
+    return status
+
+
+class RefreshAhead:
+    # Har cached key ke hits uski cache lifetime me gino. Jo key REFRESH_MIN_HITS tak
+    # pahunch jaye aur expiry REFRESH_AHEAD_SECONDS ke andar ho, use chhote thread pool
+    # par re-resolve karo. Thread pehle track() par start hota hai, taaki gunicorn
+    # --preload ke fork ke baad har worker ka apna ho.
+    def __init__(self, refresh, workers: int) -> None:
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._refresh = refresh
+        self._workers = workers
+        self._entries: dict[str, dict] = {}
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pending.clear()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="refresh"
+        )
+        threading.Thread(target=self._loop, name="refresh-ahead", daemon=True).start()
+
+    def track(self, key: str, url: str, all_media: bool, ttl: int) -> None:
+        if self._workers <= 0:
+            return
+        with self._lock:
+            self._ensure_started()
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= REFRESH_MAX_TRACKED:
+                    coldest = min(self._entries, key=lambda k: self._entries[k]["hits"])
+                    del self._entries[coldest]
+                entry = self._entries[key] = {"hits": 0}
+            entry.update(url=url, all_media=all_media, expires_at=time.monotonic() + ttl)
+
+    def touch(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["hits"] += 1
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(REFRESH_SCAN_INTERVAL)
+            self.scan()
+
+    def scan(self) -> None:
+        # Overload me live requests ko upstream budget chahiye; refresh agle scan tak ruke.
+        if ADMISSION.stats()["queued"]:
+            return
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                remaining = entry["expires_at"] - now
+                hot = entry["hits"] >= REFRESH_MIN_HITS
+                if remaining <= 0 and not hot:
+                    del self._entries[key]
+                    continue
+                if not hot or remaining > REFRESH_AHEAD_SECONDS or key in self._pending:
+                    continue
+                entry["hits"] = 0
+                self._pending.add(key)
+                due.append((key, entry["url"], entry["all_media"]))
+        for key, url, all_media in due:
+            self._executor.submit(self._run, key, url, all_media)
+
+    def _run(self, key: str, url: str, all_media: bool) -> None:
+        try:
+            status = self._refresh(key, url, all_media)
+        except Exception:
+            status = 500
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+        if status is None:
+            outcome = "skipped"
+        else:
+            outcome = "ok" if status == 200 else "error"
+        with self._lock:
+            if outcome == "ok":
+                self.refreshed += 1
+            elif outcome == "error":
+                self.failed += 1
+            else:
+                self.skipped += 1
+        METRICS.inc("extract_refresh_total", outcome=outcome)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tracked": len(self._entries),
+                "pending": len(self._pending),
+                "refreshed": self.refreshed,
+                "failed": self.failed,
+                "skipped": self.skipped,
+            }
+
+
+REFRESHER = RefreshAhead(refresh_entry, REFRESH_WORKERS)
+
+
+def lookup(url: str, deadline: Deadline, all_media: bool = False) -> tuple[int, dict]:
+    url = expand_short_link(url, deadline)
+    key = lookup_key(url, all_media)
+    cached = cached_response(key)
+    if cached is not None:
+        return cached
+
+    try:
+        return INFLIGHT.do(
+            key, lambda: resolve(url, key, deadline, all_media), deadline.remaining()
+        )
+    except DeadlineExceeded:
+        return timed_out()
+
+
+def check_auth():
+    auth = request.headers.get("Authorization", "")
+    expected = f"Bearer {API_TOKEN}"
+    if not API_TOKEN:
+        return error("API_TOKEN server par set nahi hai.", 500)
+    if auth != expected:
+        return error("Unauthorized", 401)
+    return None
+
+
+def batch_line(url: str, status: int, result: dict) -> str:
+    if status == 200:
+        item = {"ok": True, **result, "source": url}
+    else:
+        item = {"ok": False, "status": status, **result, "source": url}
+    return json.dumps(item, ensure_ascii=False) + "\n"
+
+
+def metrics_gauges() -> dict[str, float]:
+    gauges = {
+        "extract_cache_hits": RESULT_CACHE.hits,
+        "extract_cache_misses": RESULT_CACHE.misses,
+        "extract_cache_entries": len(RESULT_CACHE),
+        "extract_failure_cache_entries": len(FAILURE_CACHE),
+        "extract_short_link_cache_entries": len(SHORT_LINK_CACHE),
+    }
+    for name, value in INFLIGHT.stats().items():
+        gauges[f"extract_singleflight_{name}"] = value
+    for name, value in YTDLP_POOL.stats().items():
+        gauges[f"extract_ytdlp_pool_{name}"] = value
+    for name, value in HTTP_POOL.stats().items():
+        gauges[f"extract_http_pool_{name}"] = value
+    for name, value in UPSTREAM.stats().items():
+        gauges[f"extract_upstream_{name}"] = value
+    for name, value in ADMISSION.stats().items():
+        gauges[f"extract_admission_{name}"] = value
+    for name, value in REFRESHER.stats().items():
+        gauges[f"extract_refresh_{name}"] = value
+    return gauges
+
+
+@app.after_request
+def count_response(response):
+    METRICS.inc(
+        "extract_responses_total",
+        endpoint=request.endpoint or "unknown",
+        status=str(response.status_code),
+    )
+    return response
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(
+        METRICS.render(metrics_gauges()),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
+@app.get("/health")
+def health():
     return jsonify({
         "ok": True,
-        "media_url": media_url,
-        "filename": filename,
-        "source": url,
+        "cache": {
+            "backend": RESULT_CACHE_BACKEND,
+            "hits": RESULT_CACHE.hits,
+            "misses": RESULT_CACHE.misses,
+        },
+        "singleflight": INFLIGHT.stats(),
+        "ytdlp_pool": YTDLP_POOL.stats(),
+        "upstream": UPSTREAM.stats(),
+        "admission": ADMISSION.stats(),
+        "refresh": REFRESHER.stats(),
     })
 
 
+@app.post("/extract")
+def extract():
+    deadline = Deadline(REQUEST_BUDGET)
+    with METRICS.timer("extract_stage_seconds", stage="auth"):
+        denied = check_auth()
+    if denied is not None:
+        return denied
+
+    with METRICS.timer("extract_stage_seconds", stage="validate"):
+        payload = request.get_json(silent=True) or {}
+        url = str(payload.get("url", "")).strip()
+        supported = bool(url) and is_supported_url(url)
+
+    if not url:
+        return error("URL required hai.", 400)
+    if not supported:
+        return error("Sirf Instagram/Facebook URLs supported hain.", 400)
+    try:
+        max_height, max_bytes = parse_limits(payload)
+    except ValueError as exc:
+        return error(str(exc), 400)
+    all_media = is_truthy(payload.get("all_media"))
+
+    status, result = lookup(url, deadline, all_media)
+    if status != 200:
+        response = jsonify(result)
+        response.status_code = status
+        if "retry_after" in result:
+            response.headers["Retry-After"] = str(result["retry_after"])
+        return response
+
+    result = with_download_urls(select_variant(result, max_height, max_bytes), public_base_url())
+    with METRICS.timer("extract_stage_seconds", stage="serialize"):
+        return jsonify({"ok": True, **result, "source": url})
+
+
+@app.post("/extract/batch")
+def extract_batch():
+    denied = check_auth()
+    if denied is not None:
+        return denied
+
+    payload = request.get_json(silent=True) or {}
+    urls = payload.get("urls")
+    if not isinstance(urls, list) or not urls:
+        return error("urls non-empty list honi chahiye.", 400)
+    if len(urls) > BATCH_MAX_URLS:
+        return error(f"Ek batch me max {BATCH_MAX_URLS} URLs.", 400)
+    try:
+        max_height, max_bytes = parse_limits(payload)
+    except ValueError as exc:
+        return error(str(exc), 400)
+    all_media = is_truthy(payload.get("all_media"))
+
+    accepted: list[str] = []
+    rejected: list[str] = []
+    for value in urls:
+        url = str(value or "").strip()
+        if not url or not is_supported_url(url):
+            rejected.append(url)
+            continue
+        accepted.append(url)
+
+    # Short links pehle expand, taaki ek post ke do links ek hi extraction share karein.
+    targets = {url: url for url in accepted}
+    short = [url for url in accepted if is_short_link(url)]
+    if short:
+        with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+            targets.update(zip(short, executor.map(
+                lambda u: expand_short_link(u, Deadline(REQUEST_BUDGET)), short
+            )))
+    by_key: dict[str, list[str]] = {}
+    for url in accepted:
+        by_key.setdefault(lookup_key(targets[url], all_media), []).append(url)
+    # Generator request context ke bahar chalta hai, isliye base abhi nikaal lo.
+    base_url = public_base_url()
+
+    # Har submitted URL ki ek line, jaise hi uska shortcode resolve ho.
+    def generate():
+        for url in rejected:
+            message = {"error": "Sirf Instagram/Facebook URLs supported hain."}
+            yield batch_line(url, 400, message)
+
+        # Har item ka apna budget, jo uske worker par shuru hone se chalta hai; warna
+        # queue ke peeche wale items bina try hue 504 ho jaate.
+        def run(url: str) -> tuple[int, dict]:
+            return lookup(url, Deadline(REQUEST_BUDGET), all_media)
+
+        executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+        try:
+            futures = {
+                executor.submit(run, sources[0]): key
+                for key, sources in by_key.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    status, result = future.result()
+                except Exception:
+                    status, result = 500, {"error": "Extractor crash ho gaya."}
+                if status == 200:
+                    result = with_download_urls(
+                        select_variant(result, max_height, max_bytes), base_url
+                    )
+                yield "".join(
+                    batch_line(url, status, result) for url in by_key[futures[future]]
+                )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@app.get("/download")
+def download():
+    # Auth API_TOKEN se nahi, /extract ke diye signed link se: browser/app seedha yahan aata hai.
+    if not DOWNLOAD_SIGNING_KEY:
+        return error("DOWNLOAD_SIGNING_KEY / API_TOKEN server par set nahi hai.", 500)
+    media_url = str(request.args.get("u", "")).strip()
+    requested = str(request.args.get("fn", "")).strip()
+    expires = str(request.args.get("exp", "")).strip()
+    signature = str(request.args.get("sig", ""))
+    if not expires.isdigit() or not hmac.compare_digest(
+        signature, download_signature(media_url, requested, int(expires))
+    ):
+        return error("Download link invalid hai.", 403)
+    if int(expires) < time.time():
+        return error("Download link expire ho gaya. Dobara extract karein.", 410)
+    if not is_media_url(media_url):
+        return error("Sirf extract kiya hua Instagram/Facebook CDN media URL chalega.", 400)
+    stem, _, ext = requested.rpartition(".")
+    filename = sanitize_filename(stem or requested or "reel", ext if stem else "mp4")
+
+    headers = {"User-Agent": "Mozilla/5.0", "Accept-Encoding": "identity"}
+    for name in FORWARDED_REQUEST_HEADERS:
+        if request.headers.get(name):
+            headers[name] = request.headers[name]
+
+    # Upstream response generator ke khatam (ya client disconnect) hone tak khula rehta hai.
+    stack = ExitStack()
+    try:
+        upstream = stack.enter_context(
+            HTTP_POOL.open(media_url, headers, DOWNLOAD_TIMEOUT, allow=is_media_url)
+        )
+    except HTTPError as exc:
+        stack.close()
+        if exc.code == 416:
+            response = error("Requested range available nahi hai.", 416)
+            if exc.headers.get("Content-Range"):
+                response.headers["Content-Range"] = exc.headers["Content-Range"]
+            return response
+        if exc.code in (403, 404, 410):
+            return error("Media link expire ho gaya. Dobara extract karein.", 410)
+        return error("Media server ne error diya.", 502)
+    except RedirectNotAllowed:
+        stack.close()
+        return error("Media server ne CDN ke bahar redirect kiya.", 502)
+    except Exception:
+        stack.close()
+        return error("Media server tak connection nahi ho paya.", 502)
+
+    def relay():
+        try:
+            while True:
+                chunk = upstream.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    return
+                METRICS.inc("extract_download_bytes_total", len(chunk))
+                yield chunk
+        finally:
+            stack.close()
+
+    response = Response(relay(), status=upstream.status, direct_passthrough=True)
+    for name in FORWARDED_RESPONSE_HEADERS:
+        value = upstream.getheader(name)
+        if value:
+            response.headers[name] = value
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=\"{filename}\"; filename*=UTF-8''{quote(filename)}"
+    )
+    return response
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
@@ -0,0 +1,384 @@
+import asyncio
+import codecs
+import html
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse, urlunparse
+
+import httpx
+
+from app import (
+    API_TOKEN,
+    METRICS,
+    REQUEST_BUDGET,
+    MAX_REDIRECTS,
+    RESULT_CACHE,
+    SHORT_LINK_CACHE,
+    SHORT_LINK_TIMEOUT,
+    SHORT_LINK_TTL,
+    SHORTCODE_RE,
+    UPSTREAM,
+    YTDLP_POOL,
+    Deadline,
+    DeadlineExceeded,
+    cached_response,
+    extract_all_media,
+    extract_media,
+    is_short_link,
+    is_supported_url,
+    is_truthy,
+    lookup_key,
+    media_key,
+    metrics_gauges,
+    parse_limits,
+    remember,
+    sanitize_filename,
+    select_variant,
+    short_link_key,
+    throttled,
+    timed_out,
+)
+
+# yt-dlp blocking hai, isliye sirf isi sized executor me chalta hai; HTML path event loop par.
+YTDLP_WORKERS = int(os.getenv("ASGI_YTDLP_WORKERS", "8"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("ASGI_HTTP_MAX_CONNECTIONS", "100"))
+HTML_TIMEOUT = 25.0
+HTML_CHUNK_SIZE = 16384
+# Chunk boundary par kata match bhi mil jaye, isliye itna tail rakho.
+HTML_SCAN_OVERLAP = 8192
+# Jaldi rukne ke baad itna aur padh lo taaki keep-alive connection pool me wapas jaye;
+# isse lamba bacha ho to connection band.
+HTML_DRAIN_LIMIT = 65536
+HTML_MEDIA_GROUPS = ("og_video", "video_url", "playback_url")
+HTML_SCAN_RE = re.compile(
+    r'<meta[^>]+property=["\']og:video(?::secure_url)?["\'][^>]+content=["\'](?P<og_video>[^"\']+)["\']'
+    r'|"video_url":"(?P<video_url>https:[^"]+)"'
+    r'|"playback_url":"(?P<playback_url>https:[^"]+)"'
+    r'|<meta[^>]+property=["\']og:title["\'][^>]+content=["\'](?P<title>[^"\']+)["\']',
+    re.IGNORECASE,
+)
+HTML_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) "
+        "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 "
+        "Mobile/15E148 Safari/604.1"
+    ),
+    "Accept-Language": "en-US,en;q=0.9",
+    "Referer": "https://www.instagram.com/",
+}
+
+EXECUTOR = ThreadPoolExecutor(max_workers=YTDLP_WORKERS, thread_name_prefix="ytdlp")
+_client: httpx.AsyncClient | None = None
+_inflight: dict[str, asyncio.Future] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            follow_redirects=True,
+            headers=HTML_HEADERS,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS),
+        )
+    return _client
+
+
+def build_candidate_urls(url: str) -> list[str]:
+    candidates: list[str] = []
+
+    def add(value: str) -> None:
+        value = value.strip()
+        if value and value not in candidates:
+            candidates.append(value)
+
+    add(url)
+    parsed = urlparse(url)
+    if parsed.scheme and parsed.netloc:
+        add(urlunparse((parsed.scheme, parsed.netloc, parsed.path, "", "", "")))
+
+    if "instagram.com" in (parsed.hostname or "").lower() and not is_short_link(url):
+        match = SHORTCODE_RE.search(parsed.path or "")
+        if match:
+            add(f"https://www.instagram.com/{match.group(1)}/{match.group(2)}/")
+            add(f"https://www.instagram.com/{match.group(1)}/{match.group(2)}/embed/captioned/")
+
+    key = media_key(url)
+    if key and key.startswith("facebook:"):
+        add(f"https://www.facebook.com/watch/?v={key.split(':', 1)[1]}")
+
+    return candidates
+
+
+def decode_escaped_url(value: str) -> str:
+    value = html.unescape(value.strip())
+    value = value.replace("\\/", "/").replace("\\u0026", "&")
+    if value.startswith("//"):
+        value = "https:" + value
+    return value
+
+
+async def drain_body(response: httpx.Response, chunks) -> None:
+    # Poora body padh liya ho tabhi httpx connection pool me lautata hai.
+    length = response.headers.get("content-length", "")
+    if length.isdigit() and int(length) - response.num_bytes_downloaded > HTML_DRAIN_LIMIT:
+        return
+    drained = 0
+    async for chunk in chunks:
+        drained += len(chunk)
+        if drained > HTML_DRAIN_LIMIT:
+            return
+
+
+async def extract_from_public_html(url: str, deadline: Deadline) -> dict | None:
+    timeout = deadline.timeout(HTML_TIMEOUT)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    found: dict[str, str] = {}
+    buffer = ""
+    async with get_client().stream("GET", url, timeout=timeout) as response:
+        response.raise_for_status()
+        chunks = response.aiter_bytes(HTML_CHUNK_SIZE)
+        async for chunk in chunks:
+            buffer += decoder.decode(chunk)
+            for match in HTML_SCAN_RE.finditer(buffer):
+                found.setdefault(match.lastgroup, match.group(match.lastgroup))
+            if "title" in found and any(g in found for g in HTML_MEDIA_GROUPS):
+                await drain_body(response, chunks)
+                break
+            buffer = buffer[-HTML_SCAN_OVERLAP:]
+
+    media_url = ""
+    for group in HTML_MEDIA_GROUPS:
+        if group in found:
+            media_url = decode_escaped_url(found[group])
+            break
+    if not media_url.startswith("http"):
+        return None
+
+    title = html.unescape(found.get("title", "")).strip() or "reel"
+    path = urlparse(media_url).path
+    ext = (path.rsplit(".", 1)[-1].lower() if "." in path else "").strip()
+    if not ext or len(ext) > 5:
+        ext = "mp4"
+    return {"media_url": media_url, "filename": sanitize_filename(title, ext)}
+
+
+async def expand_short_link(url: str, deadline: Deadline) -> str:
+    # app.expand_short_link jaisa, par event loop par; cache dono modes me same hai.
+    if not is_short_link(url):
+        return url
+    cache_key = short_link_key(url)
+    cached = SHORT_LINK_CACHE.get(cache_key)
+    if cached is not None:
+        METRICS.inc("extract_short_links_total", outcome="cached")
+        return cached["url"]
+
+    wait = UPSTREAM.reserve(UPSTREAM.wait_budget(deadline))
+    if wait is None:
+        return url
+    await asyncio.sleep(wait)
+    target = url
+    try:
+        for _ in range(MAX_REDIRECTS):
+            async with get_client().stream(
+                "GET", target, follow_redirects=False,
+                timeout=deadline.timeout(SHORT_LINK_TIMEOUT),
+            ) as response:
+                location = response.headers.get("location")
+                if not response.is_redirect or not location:
+                    response.raise_for_status()
+                    break
+            target = urljoin(target, location)
+            if media_key(target) is not None:
+                break
+    except Exception as exc:
+        UPSTREAM.feedback(exc)
+        METRICS.inc("extract_short_links_total", outcome="error")
+        return url
+    UPSTREAM.feedback(None)
+    # Chain kahin aur khatam ho (login page, consent wall) to cache mat karo;
+    # yt-dlp ko original link do, wo khud follow karega.
+    if media_key(target) is None:
+        METRICS.inc("extract_short_links_total", outcome="unresolved")
+        return url
+    METRICS.inc("extract_short_links_total", outcome="resolved")
+    SHORT_LINK_CACHE.set(cache_key, {"url": target}, SHORT_LINK_TTL)
+    return target
+
+
+async def resolve(
+    url: str, key: str, deadline: Deadline, all_media: bool = False
+) -> tuple[int, dict]:
+    cached = cached_response(key)
+    if cached is not None:
+        return cached
+
+    loop = asyncio.get_running_loop()
+    extractor = extract_all_media if all_media else extract_media
+    try:
+        status, result = await asyncio.wait_for(
+            loop.run_in_executor(EXECUTOR, extractor, url, deadline),
+            deadline.remaining(),
+        )
+    except asyncio.TimeoutError:
+        return timed_out()
+
+    # yt-dlp fail hua to public HTML pages try karo, bina thread pin kiye.
+    # HTML page par sirf pehla item hota hai, isliye all_media me ye fallback nahi.
+    if status == 422 and not all_media:
+        for candidate_url in build_candidate_urls(url):
+            wait = UPSTREAM.reserve(UPSTREAM.wait_budget(deadline))
+            if wait is None:
+                return throttled()
+            await asyncio.sleep(wait)
+            started = time.perf_counter()
+            try:
+                html_result = await extract_from_public_html(candidate_url, deadline)
+            except DeadlineExceeded:
+                return timed_out()
+            except Exception as exc:
+                UPSTREAM.feedback(exc)
+                METRICS.observe(
+                    "extract_attempt_seconds", time.perf_counter() - started,
+                    strategy="html", outcome="error",
+                )
+                continue
+            UPSTREAM.feedback(None)
+            METRICS.observe(
+                "extract_attempt_seconds", time.perf_counter() - started,
+                strategy="html", outcome="ok" if html_result else "empty",
+            )
+            if html_result is not None:
+                status, result = 200, html_result
+                break
+
+    remember(key, status, result, url, all_media)
+    return status, result
+
+
+async def lookup(url: str, deadline: Deadline, all_media: bool = False) -> tuple[int, dict]:
+    url = await expand_short_link(url, deadline)
+    key = lookup_key(url, all_media)
+    cached = cached_response(key)
+    if cached is not None:
+        return cached
+
+    # Same key ki concurrent requests ek hi resolve ka result share karti hain.
+    flight = _inflight.get(key)
+    if flight is None:
+        flight = asyncio.ensure_future(resolve(url, key, deadline, all_media))
+        _inflight[key] = flight
+        flight.add_done_callback(lambda _: _inflight.pop(key, None))
+    try:
+        return await asyncio.wait_for(asyncio.shield(flight), deadline.remaining())
+    except asyncio.TimeoutError:
+        return timed_out()
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_body(
+    send, body: bytes, content_type: bytes, status: int, headers: list | None = None
+) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type),
+            (b"content-length", str(len(body)).encode()),
+            *(headers or []),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, payload: dict, status: int = 200) -> None:
+    METRICS.inc("extract_responses_total", endpoint="asgi", status=str(status))
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = []
+    if "retry_after" in payload:
+        headers.append((b"retry-after", str(payload["retry_after"]).encode()))
+    await send_body(send, body, b"application/json", status, headers)
+
+
+async def extract(scope, receive, send) -> None:
+    deadline = Deadline(REQUEST_BUDGET)
+    headers = dict(scope["headers"])
+    auth = headers.get(b"authorization", b"").decode("latin-1")
+    if not API_TOKEN:
+        message = "API_TOKEN server par set nahi hai."
+        return await send_json(send, {"error": message}, 500)
+    if auth != f"Bearer {API_TOKEN}":
+        return await send_json(send, {"error": "Unauthorized"}, 401)
+
+    try:
+        payload = json.loads(await read_body(receive) or b"{}")
+    except ValueError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+    url = str(payload.get("url", "")).strip()
+
+    if not url:
+        return await send_json(send, {"error": "URL required hai."}, 400)
+    if not is_supported_url(url):
+        message = "Sirf Instagram/Facebook URLs supported hain."
+        return await send_json(send, {"error": message}, 400)
+    try:
+        max_height, max_bytes = parse_limits(payload)
+    except ValueError as exc:
+        return await send_json(send, {"error": str(exc)}, 400)
+
+    status, result = await lookup(url, deadline, is_truthy(payload.get("all_media")))
+    if status != 200:
+        return await send_json(send, result, status)
+    result = select_variant(result, max_height, max_bytes)
+    await send_json(send, {"ok": True, **result, "source": url})
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _client is not None:
+                await _client.aclose()
+            EXECUTOR.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"].rstrip("/") or "/"
+    method = scope["method"]
+    if path == "/health" and method == "GET":
+        return await send_json(send, {
+            "ok": True,
+            "cache": {"hits": RESULT_CACHE.hits, "misses": RESULT_CACHE.misses},
+            "inflight": len(_inflight),
+            "ytdlp_pool": YTDLP_POOL.stats(),
+            "upstream": UPSTREAM.stats(),
+        })
+    if path == "/metrics" and method == "GET":
+        gauges = metrics_gauges()
+        gauges["extract_asgi_inflight"] = len(_inflight)
+        body = METRICS.render(gauges).encode("utf-8")
+        return await send_body(send, body, b"text/plain; version=0.0.4", 200)
+    if path == "/extract" and method == "POST":
+        return await extract(scope, receive, send)
+    await send_json(send, {"error": "Not found"}, 404)
@@ -0,0 +1,58 @@
+import io
+import os
+from contextlib import contextmanager
+
+import extract
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench", "fixtures")
+AMBIGUOUS = (
+    "ERROR: [Instagram] DAbc123: Requested content is not available, "
+    "rate-limit reached or login required. Use --cookies"
+)
+
+
+class FakeResponse(io.BytesIO):
+    length = None
+
+
+class FailingYDL:
+    def extract_info(self, url, download=False):
+        raise Exception(AMBIGUOUS)
+
+
+def serve_login_wall(monkeypatch):
+    with open(os.path.join(FIXTURES, "login_wall.html"), encoding="utf-8") as fh:
+        body = fh.read().replace("{{padding}}", "").encode()
+
+    @contextmanager
+    def fake_open(url, headers, timeout, **kwargs):
+        yield FakeResponse(body)
+
+    @contextmanager
+    def fake_borrow(opts, cookies=None):
+        yield FailingYDL()
+
+    monkeypatch.setattr(extract.HTTP_POOL, "open", fake_open)
+    monkeypatch.setattr(extract.YTDLP_POOL, "borrow", fake_borrow)
+
+
+def test_ambiguous_ytdlp_message_alone_is_rate_limited():
+    assert extract.classify_failure([f"yt-dlp: {AMBIGUOUS}"]) == "rate_limited"
+
+
+def test_login_wall_page_settles_ambiguous_message(monkeypatch):
+    serve_login_wall(monkeypatch)
+    status, payload = extract.extract_media(
+        "https://www.instagram.com/reel/DAbc123/", extract.Deadline(10)
+    )
+    assert status == 422
+    assert any(extract.LOGIN_WALL_MESSAGE in part for part in payload["detail"].split(" | "))
+    assert payload["reason"] == "login_required"
+
+
+def test_real_429_stays_rate_limited():
+    errors = [
+        "yt-dlp: HTTP Error 429: Too Many Requests",
+        f"html: {extract.LOGIN_WALL_MESSAGE}",
+    ]
+    assert extract.classify_failure(errors) == "rate_limited"
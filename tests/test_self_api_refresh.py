@@ -0,0 +1,33 @@
+import app as self_api
+
+
+def test_refresh_skipped_when_admission_full(monkeypatch):
+    calls = []
+    monkeypatch.setattr(self_api, "extract_media", lambda url, deadline: calls.append(url))
+    gate = self_api.AdmissionGate(max_inflight=1, max_queue=4, max_wait=1.0)
+    monkeypatch.setattr(self_api, "ADMISSION", gate)
+
+    with gate.admit(self_api.Deadline(5)):
+        status = self_api.refresh_entry("instagram:full", "https://www.instagram.com/reel/full/", False)
+
+    assert status is None
+    assert calls == []
+    assert gate.stats() == {"inflight": 0, "queued": 0, "admitted": 1, "shed": 0}
+
+
+def test_refresh_holds_admission_slot(monkeypatch):
+    gate = self_api.AdmissionGate(max_inflight=2, max_queue=4, max_wait=1.0)
+    seen = []
+
+    def fake_extract(url, deadline):
+        seen.append(gate.stats()["inflight"])
+        return 422, {"error": "nope"}
+
+    monkeypatch.setattr(self_api, "extract_media", fake_extract)
+    monkeypatch.setattr(self_api, "ADMISSION", gate)
+
+    status = self_api.refresh_entry("instagram:slot", "https://www.instagram.com/reel/slot/", False)
+
+    assert status == 422
+    assert seen == [1]
+    assert gate.stats()["inflight"] == 0